@@ -13,12 +13,16 @@ Este script pode operar em dois modos:
     - Pula a geração de embeddings.
     - Carrega um arquivo .pkl de embeddings (gerado no Colab).
     - Constrói o índice FAISS rapidamente a partir desses embeddings.
+
+A geração lê o parquet em row-groups (streaming via pyarrow), então a
+memória residente fica em O(lote) mesmo para datasets grandes.
 """
 
 import pandas as pd
+import pyarrow.parquet as pq
 
 from cgu_rag.pipeline import CGURecommendationPipeline
-from cgu_rag.settings import DATA_DIR, VECTORS_DIR, MODEL_NAME, DEVICE
+from cgu_rag.settings import DATA_DIR, VECTORS_DIR, MODEL_NAME, DEVICE, EMBEDDING_BACKEND
 
 # Mude para True se você já gerou os .pkl no Colab e quer apenas construir
 # o índice .faiss localmente (muito mais rápido e não precisa de GPU).
@@ -30,76 +34,80 @@ RECRIAR_RECURSOS = True
 def ensure_sentence(df: pd.DataFrame, is_pedidos=True) -> pd.DataFrame:
     """Garante que a coluna 'sentence' exista."""
     if "sentence" not in df.columns:
+        # str.cat despacha para um loop em C no pandas, sem alocar as
+        # Series intermediárias do `+` em nível Python
         if is_pedidos:
-            df["sentence"] = (df["ResumoSolicitacao"].fillna("") + " <SEP> " + df["DetalhamentoSolicitacao"].fillna(""))
+            df["sentence"] = df["ResumoSolicitacao"].fillna("").str.cat(
+                df["DetalhamentoSolicitacao"].fillna(""), sep=" <SEP> ")
         else:
-            df["sentence"] = (df["TipoRecurso"].fillna("") + " <SEP> " + df["DescRecurso"].fillna(""))
+            df["sentence"] = df["TipoRecurso"].fillna("").str.cat(
+                df["DescRecurso"].fillna(""), sep=" <SEP> ")
     return df
 
 
-def main() -> None:
-    VECTORS_DIR.mkdir(parents=True, exist_ok=True)
-    pipe = CGURecommendationPipeline(MODEL_NAME, DEVICE)
+def projection_columns(parquet_path, id_column, component_columns):
+    """Colunas mínimas a projetar na leitura: usa 'sentence' pronta se existir."""
+    names = set(pq.ParquetFile(parquet_path).schema_arrow.names)
+    if "sentence" in names:
+        return [id_column, "sentence"]
+    return [id_column] + component_columns
 
-    # --- PROCESSAMENTO DE PEDIDOS ---
-    print("\n--- INICIANDO PROCESSAMENTO DE PEDIDOS ---")
-    df_ped = pd.read_parquet(DATA_DIR / "dt_pedidos.parquet")
-    df_ped = ensure_sentence(df_ped, is_pedidos=True)
-    pedidos_pkl_path = VECTORS_DIR / "pedidos.pkl"
+
+def process_store(pipe, store_type, parquet_path, pkl_path, id_column, component_columns, is_pedidos):
+    """Gera (se necessário) os embeddings de um store e constrói seu índice FAISS."""
+    print(f"\n--- INICIANDO PROCESSAMENTO DE {store_type.upper()} ---")
 
     if not USE_PRECOMPUTED_EMBEDDINGS:
-        print(f"Gerando embeddings para {len(df_ped)} pedidos (BATCH_SIZE={BATCH_SIZE})...")
-        pipe.generate_and_save_embeddings(
-            df=df_ped,
-            id_column="ProtocoloPedido",
-            output_path=pedidos_pkl_path,
+        pipe.generate_and_save_embeddings_from_parquet(
+            parquet_path,
+            id_column=id_column,
+            sentence_builder=lambda chunk: ensure_sentence(chunk, is_pedidos=is_pedidos)["sentence"],
+            columns=projection_columns(parquet_path, id_column, component_columns),
+            output_path=pkl_path,
             batch_size=BATCH_SIZE,
         )
 
-    print(f"Carregando embeddings de '{pedidos_pkl_path}' para construir o índice FAISS...")
-    ids_ped, emb_ped, _ = pipe.load_embeddings_from_pickle(pedidos_pkl_path)
-    if ids_ped:
+    print(f"Carregando embeddings de '{pkl_path}' para construir o índice FAISS...")
+    ids, emb, _ = pipe.load_embeddings_from_pickle(pkl_path)
+    if ids:
         pipe.build_vectorstore_from_embeddings(
-            ids=ids_ped,
-            embeddings=emb_ped,
-            store_type='pedidos',
+            ids=ids,
+            embeddings=emb,
+            store_type=store_type,
             persist_directory=VECTORS_DIR
         )
-        print("✅ Índice 'pedidos.faiss' construído com sucesso!\n")
+        print(f"✅ Índice de '{store_type}' construído com sucesso!\n")
     else:
-        print(f"❌ Falha ao carregar embeddings de '{pedidos_pkl_path}'. Pulando construção do índice.")
+        print(f"❌ Falha ao carregar embeddings de '{pkl_path}'. Pulando construção do índice.")
+
+
+def main() -> None:
+    VECTORS_DIR.mkdir(parents=True, exist_ok=True)
+    pipe = CGURecommendationPipeline(MODEL_NAME, DEVICE, backend=EMBEDDING_BACKEND)
+
+    process_store(
+        pipe,
+        store_type="pedidos",
+        parquet_path=DATA_DIR / "dt_pedidos.parquet",
+        pkl_path=VECTORS_DIR / "pedidos.pkl",
+        id_column="ProtocoloPedido",
+        component_columns=["ResumoSolicitacao", "DetalhamentoSolicitacao"],
+        is_pedidos=True,
+    )
 
-    # --- PROCESSAMENTO DE RECURSOS (opcional) ---
     if RECRIAR_RECURSOS:
-        print("\n--- INICIANDO PROCESSAMENTO DE RECURSOS ---")
-        df_rec = pd.read_parquet(DATA_DIR / "dt_recursos.parquet")
-        df_rec = ensure_sentence(df_rec, is_pedidos=False)
-        recursos_pkl_path = VECTORS_DIR / "recursos.pkl"
-
-        if not USE_PRECOMPUTED_EMBEDDINGS:
-            print(f"Gerando embeddings para {len(df_rec)} recursos (BATCH_SIZE={BATCH_SIZE})...")
-            pipe.generate_and_save_embeddings(
-                df=df_rec,
-                id_column="IdRecurso",
-                output_path=recursos_pkl_path,
-                batch_size=BATCH_SIZE,
-            )
-
-        print(f"Carregando embeddings de '{recursos_pkl_path}' para construir o índice FAISS...")
-        ids_rec, emb_rec, _ = pipe.load_embeddings_from_pickle(recursos_pkl_path)
-        if ids_rec:
-            pipe.build_vectorstore_from_embeddings(
-                ids=ids_rec,
-                embeddings=emb_rec,
-                store_type='recursos',
-                persist_directory=VECTORS_DIR
-            )
-            print("✅ Índice 'recursos.faiss' construído com sucesso!\n")
-        else:
-            print(f"❌ Falha ao carregar embeddings de '{recursos_pkl_path}'. Pulando construção do índice.")
+        process_store(
+            pipe,
+            store_type="recursos",
+            parquet_path=DATA_DIR / "dt_recursos.parquet",
+            pkl_path=VECTORS_DIR / "recursos.pkl",
+            id_column="IdRecurso",
+            component_columns=["TipoRecurso", "DescRecurso"],
+            is_pedidos=False,
+        )
     else:
         print("\n• Geração de RECURSOS pulada (RECRIAR_RECURSOS=False)")
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
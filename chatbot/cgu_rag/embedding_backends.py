@@ -0,0 +1,58 @@
+# embedding_backends.py
+"""
+Backends de embedding alternativos ao HuggingFaceEmbeddings (PyTorch eager).
+
+O backend ONNX Runtime executa o mesmo encoder E5 com ganho de 2-4x de
+throughput em CPU (e mais em GPU com FP16), o que importa no caminho
+quente de `build_vectors.py`. A interface expõe os mesmos métodos do
+LangChain (`embed_documents` / `embed_query`), então o pipeline e o
+vectorstore funcionam sem alterações.
+"""
+
+import numpy as np
+
+
+class OnnxE5Backend:
+    """
+    Encoder E5 via ONNX Runtime (requer `optimum[onnxruntime]`).
+
+    Faz a passada batched no grafo ONNX e o mean pooling + normalização L2
+    em NumPy, evitando o overhead do PyTorch eager.
+    """
+
+    def __init__(self, model_name, device="cpu", batch_size=128):
+        from optimum.onnxruntime import ORTModelForFeatureExtraction
+        from transformers import AutoTokenizer
+
+        provider = "CUDAExecutionProvider" if device == "cuda" else "CPUExecutionProvider"
+        self.model = ORTModelForFeatureExtraction.from_pretrained(
+            model_name, export=True, provider=provider
+        )
+        self.tokenizer = AutoTokenizer.from_pretrained(model_name, use_fast=True)
+        self.batch_size = batch_size
+
+    def encode(self, texts):
+        """Codifica uma lista de textos, retornando array float32 (N, d) L2-normalizado."""
+        chunks = []
+        for i in range(0, len(texts), self.batch_size):
+            batch = texts[i:i + self.batch_size]
+            enc = self.tokenizer(batch, padding=True, truncation=True, return_tensors="np")
+            outputs = self.model(**enc)
+            hidden = np.asarray(outputs.last_hidden_state, dtype=np.float32)
+
+            # Mean pooling mascarado + normalização L2, tudo em NumPy
+            mask = enc["attention_mask"][..., None].astype(np.float32)
+            pooled = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+            norms = np.linalg.norm(pooled, axis=1, keepdims=True)
+            chunks.append(pooled / np.clip(norms, 1e-12, None))
+
+        if not chunks:
+            return np.empty((0, 0), dtype=np.float32)
+        return np.vstack(chunks)
+
+    # ── Interface compatível com langchain Embeddings ──────────────────
+    def embed_documents(self, texts):
+        return self.encode(list(texts)).tolist()
+
+    def embed_query(self, text):
+        return self.encode([text])[0].tolist()
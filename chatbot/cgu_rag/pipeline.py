@@ -1,8 +1,15 @@
 # pipeline.py
+import math
 import os
 import pickle
 import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 
+# Habilita o thread-pool do tokenizer Rust antes de qualquer import do HF
+os.environ.setdefault("TOKENIZERS_PARALLELISM", "true")
+
+import faiss
 import numpy as np
 import pandas as pd
 from tqdm import tqdm
@@ -15,36 +22,134 @@ from langchain_community.vectorstores import FAISS
 from langchain_huggingface import HuggingFaceEmbeddings
 
 
+class _IdArrayDocstore:
+    """
+    Docstore mínimo para índices nativos: materializa Documents sob demanda
+    a partir do array posicional de IDs, em vez de alocar N Documents vazios
+    e um dict gigante durante o build (o maior pico de memória da etapa).
+    """
+
+    def __init__(self, ids, id_key):
+        self.ids = ids
+        self.id_key = id_key
+
+    def search(self, doc_id):
+        try:
+            return Document(page_content="", metadata={self.id_key: self.ids[int(doc_id)]})
+        except (ValueError, IndexError):
+            return f"ID {doc_id} não encontrado."
+
+
+class _PositionalIdMap:
+    """Mapeamento posição -> docstore_id sem materializar um dict de N entradas."""
+
+    def __init__(self, n):
+        self.n = n
+
+    def __getitem__(self, i):
+        if 0 <= i < self.n:
+            return str(i)
+        raise KeyError(i)
+
+    def __len__(self):
+        return self.n
+
+
 class CGURecommendationPipeline:
     """
     Pipeline de recomendação para recursos de acesso à informação da CGU
     utilizando LangChain para processamento e recuperação.
     """
 
-    def __init__(self, embedding_model_name, device="cpu"):
+    def __init__(self, embedding_model_name, device="cpu", backend="hf"):
         """
         Inicializa o pipeline com o modelo de embeddings especificado.
 
         Args:
             embedding_model_name: Nome do modelo de embeddings do HuggingFace.
             device: Dispositivo para processamento ("cpu" ou "cuda").
+            backend: Backend de inferência ("hf" para PyTorch eager, "onnx"
+                para ONNX Runtime via optimum — 2-4x mais rápido em CPU).
         """
         self.embedding_model_name = embedding_model_name
         self.device = device
 
         # Inicializar modelo de embeddings
-        self.embeddings = HuggingFaceEmbeddings(
-            model_name=embedding_model_name,
-            model_kwargs={"device": device}
-        )
+        if backend == "onnx":
+            try:
+                from cgu_rag.embedding_backends import OnnxE5Backend
+                self.embeddings = OnnxE5Backend(embedding_model_name, device=device)
+            except ImportError as e:
+                print(f"AVISO: backend ONNX indisponível ({e}); usando HuggingFaceEmbeddings")
+                backend = "hf"
+        if backend == "hf":
+            self.embeddings = HuggingFaceEmbeddings(
+                model_name=embedding_model_name,
+                model_kwargs={"device": device}
+            )
+
+        # Aquecimento: uma passada dummy força o tokenizer rápido a alocar
+        # seu thread-pool e materializa os kernels antes da primeira
+        # requisição real, tirando esse custo do caminho crítico
+        self.embeddings.embed_query("aquecimento do tokenizer")
 
         # Armazenar vectorstores
         self.vectorstore_pedidos = None
         self.vectorstore_recursos = None
 
+        # Cache de embeddings de consulta (texto -> vetor); evita reembedar
+        # a mesma query em varreduras repetidas (avaliação, buscas em lote)
+        self._query_embedding_cache = {}
+
+        # Índices binários paralelos (1 bit/dimensão, distância de Hamming
+        # via popcount) para geração barata de candidatos; ver
+        # binary_candidate_selector()
+        self._binary_indexes = {}
+
+    @contextmanager
+    def _inference_ctx(self):
+        """
+        Contexto de inferência para o forward do encoder: desliga o
+        bookkeeping do autograd e, em GPUs com suporte, usa autocast BF16
+        (metade da memória de ativação e o dobro de throughput nos tensor
+        cores). Sem torch instalado (ex.: backend ONNX) vira um no-op.
+        """
+        try:
+            import torch
+        except ImportError:
+            yield
+            return
+
+        with torch.inference_mode():
+            if self.device == "cuda" and torch.cuda.is_bf16_supported():
+                with torch.autocast(device_type="cuda", dtype=torch.bfloat16):
+                    yield
+            elif self.device == "cpu":
+                # Em CPUs com AVX-512-BF16/AMX o autocast BF16 dobra o
+                # throughput dos matmuls; sem suporte nativo o torch faz
+                # fallback transparente para FP32
+                with torch.autocast(device_type="cpu", dtype=torch.bfloat16):
+                    yield
+            else:
+                yield
+
+    @staticmethod
+    def _npy_path(file_path):
+        """Caminho do sidecar .npy que acompanha o .pkl de ids/metadados."""
+        return f"{file_path}.npy"
+
+    @staticmethod
+    def _metadata_path(file_path):
+        """Caminho do parquet de metadados que acompanha o .pkl."""
+        return f"{file_path}.metadata.parquet"
+
     def save_embeddings_to_pickle(self, ids, embeddings, file_path, include_metadata=None):
         """
-        Salva embeddings em formato pickle para carregamento rápido.
+        Salva embeddings para carregamento rápido.
+
+        A matriz vai para um sidecar `.npy` (carregável via memmap, ~4-8x
+        mais rápido que desserializar pelo pickle); o `.pkl` guarda apenas
+        ids e metadados, que são pequenos.
 
         Args:
             ids: Lista de IDs (ProtocoloPedido ou IdRecurso).
@@ -52,19 +157,24 @@ class CGURecommendationPipeline:
             file_path: Caminho completo para salvar o arquivo pickle.
             include_metadata: DataFrame com metadados a incluir (opcional).
         """
+        # FP16 corta pela metade o tamanho em disco e a banda de leitura,
+        # sem perda de recall mensurável para encoders de sentença.
+        np.save(self._npy_path(file_path), np.asarray(embeddings, dtype=np.float16))
+
         embeddings_dict = {
             'ids': ids,
-            'embeddings': embeddings,
             'model_name': self.embedding_model_name,
             'created_at': time.time()
         }
 
+        # Metadados vão em parquet próprio (escrita colunar), em vez do
+        # to_dict('records') que alocava O(N x colunas) dicts Python só
+        # para serializá-los de volta pelo pickle.
         if include_metadata is not None:
-            metadata_dict = include_metadata.to_dict(orient='records')
-            embeddings_dict['metadata'] = metadata_dict
+            include_metadata.to_parquet(self._metadata_path(file_path))
 
         with open(file_path, 'wb') as f:
-            pickle.dump(embeddings_dict, f)
+            pickle.dump(embeddings_dict, f, protocol=pickle.HIGHEST_PROTOCOL)
 
         print(f"Embeddings salvos em {file_path}")
         print(f"Total de {len(ids)} embeddings salvos, tamanho do modelo: {embeddings.shape}")
@@ -88,8 +198,23 @@ class CGURecommendationPipeline:
                 data = pickle.load(f)
 
             ids = data['ids']
-            embeddings = data['embeddings']
+            npy_path = self._npy_path(file_path)
+            if 'embeddings' in data:
+                # Formato legado: matriz inteira dentro do pickle
+                raw = data['embeddings']
+            else:
+                # Formato atual: sidecar .npy aberto via memmap (zero-copy;
+                # os bytes só são lidos quando a matriz é de fato percorrida)
+                raw = np.load(npy_path, mmap_mode='r')
+            # Arquivos podem estar em FP16 (formato atual) ou FP32 (legado);
+            # o FAISS espera float32, então o upcast acontece aqui.
+            embeddings = np.asarray(raw, dtype=np.float32)
+
+            # Metadados: parquet sidecar (formato atual, retorna DataFrame)
+            # ou a chave 'metadata' do pickle (legado, lista de records)
             metadata = data.get('metadata', None)
+            if metadata is None and os.path.exists(self._metadata_path(file_path)):
+                metadata = pd.read_parquet(self._metadata_path(file_path))
             model_name = data.get('model_name', 'unknown')
 
             print(f"Embeddings carregados em {time.time() - start_time:.2f} segundos")
@@ -121,13 +246,43 @@ class CGURecommendationPipeline:
         print(f"Gerando embeddings para {len(texts)} textos em lotes de {batch_size}...")
         start_time = time.time()
 
-        all_embeddings = []
-        for i in tqdm(range(0, len(texts), batch_size), desc="Gerando embeddings"):
-            batch_texts = texts[i:i + batch_size]
-            batch_embeddings = self.embeddings.embed_documents(batch_texts)
-            all_embeddings.extend(batch_embeddings)
-
-        embeddings_array = np.array(all_embeddings, dtype='float32')
+        def encode_batch(batch_texts):
+            with self._inference_ctx():
+                return self.embeddings.embed_documents(batch_texts)
+
+        # Agrupa textos de tamanho parecido no mesmo lote: o padding passa a
+        # ser até o maior do lote (e não até o maior do corpus), cortando
+        # FLOPs desperdiçados e estabilizando as shapes vistas pelo encoder.
+        # A permutação é desfeita ao gravar no array pré-alocado.
+        order = np.argsort([len(t) for t in texts])
+        sorted_texts = [texts[j] for j in order]
+
+        # Pré-aloca o array final e escreve cada lote in-place, em vez de
+        # acumular uma lista Python e copiar tudo de novo no np.array()
+        # (evita o pico transitório de 2x de memória).
+        #
+        # O lote i+1 é submetido a um worker em background enquanto o lote i
+        # é convertido e gravado no array: a conversão numpy/cópia deixa de
+        # ficar serializada com o forward do encoder.
+        embeddings_array = None
+        offsets = list(range(0, len(sorted_texts), batch_size))
+        with ThreadPoolExecutor(max_workers=1) as prefetcher:
+            future = prefetcher.submit(encode_batch, sorted_texts[:batch_size]) if offsets else None
+            for pos, i in enumerate(tqdm(offsets, desc="Gerando embeddings",
+                                         mininterval=1.0, miniters=max(1, len(offsets) // 200))):
+                result = future.result()
+                if pos + 1 < len(offsets):
+                    nxt = offsets[pos + 1]
+                    future = prefetcher.submit(encode_batch, sorted_texts[nxt:nxt + batch_size])
+
+                batch_embeddings = np.asarray(result, dtype=np.float32)
+                if embeddings_array is None:
+                    # A dimensão só é conhecida após o primeiro lote
+                    embeddings_array = np.empty((len(texts), batch_embeddings.shape[1]), dtype=np.float32)
+                embeddings_array[order[i:i + len(batch_embeddings)]] = batch_embeddings
+
+        if embeddings_array is None:
+            embeddings_array = np.empty((0, 0), dtype=np.float32)
         print(f"Embeddings gerados em {time.time() - start_time:.2f} segundos")
 
         metadata_to_include = df if include_metadata else None
@@ -135,33 +290,151 @@ class CGURecommendationPipeline:
 
         return ids, embeddings_array
 
-    def build_vectorstore_from_embeddings(self, ids, embeddings, store_type='pedidos', persist_directory=None):
+    def generate_and_save_embeddings_from_parquet(self, parquet_path, id_column, sentence_builder,
+                                                  columns=None, output_path=None, batch_size=128,
+                                                  read_batch_size=4096):
+        """
+        Versão streaming de `generate_and_save_embeddings`: lê o parquet em
+        row-groups via pyarrow e escreve os embeddings direto no memmap de
+        saída, mantendo a memória residente em O(lote) em vez de O(dataset).
+
+        Args:
+            parquet_path: Caminho do arquivo parquet.
+            id_column: Coluna de IDs (ProtocoloPedido ou IdRecurso).
+            sentence_builder: Função chunk (DataFrame) -> Series de textos.
+            columns: Colunas a projetar na leitura (opcional).
+            output_path: Caminho do .pkl de saída (sidecar .npy ao lado).
+            batch_size: Tamanho do lote de encoding.
+            read_batch_size: Tamanho do lote de leitura do parquet.
+        """
+        import pyarrow.parquet as pq
+
+        if output_path is None:
+            model_name_short = self.embedding_model_name.replace('/', '_')
+            output_path = f"embeddings_{id_column}_{model_name_short}.pkl"
+
+        pf = pq.ParquetFile(parquet_path)
+        total_rows = pf.metadata.num_rows
+        print(f"Gerando embeddings (streaming) para {total_rows} textos de {parquet_path}...")
+        start_time = time.time()
+
+        ids = []
+        emb = None
+        row = 0
+        for record_batch in pf.iter_batches(batch_size=read_batch_size, columns=columns):
+            chunk = record_batch.to_pandas()
+            texts = sentence_builder(chunk).fillna('').astype(str).tolist()
+            ids.extend(chunk[id_column].tolist())
+
+            for i in range(0, len(texts), batch_size):
+                with self._inference_ctx():
+                    vecs = np.asarray(
+                        self.embeddings.embed_documents(texts[i:i + batch_size]), dtype=np.float16
+                    )
+                if emb is None:
+                    # Memmap de saída criado após o primeiro lote revelar d
+                    emb = np.lib.format.open_memmap(
+                        self._npy_path(output_path), mode='w+',
+                        dtype=np.float16, shape=(total_rows, vecs.shape[1])
+                    )
+                emb[row:row + len(vecs)] = vecs
+                row += len(vecs)
+
+        if emb is not None:
+            emb.flush()
+        print(f"Embeddings gerados em {time.time() - start_time:.2f} segundos")
+
+        with open(output_path, 'wb') as f:
+            pickle.dump({
+                'ids': ids,
+                'model_name': self.embedding_model_name,
+                'created_at': time.time()
+            }, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+        print(f"Embeddings salvos em {output_path}")
+        return output_path
+
+    def _build_faiss_index(self, embeddings, index_type='auto'):
+        """
+        Constrói um índice FAISS nativo adequado ao tamanho do corpus.
+
+        Para corpora grandes usa IVF+PQ (busca sublinear e compressão de 8-32x
+        via product quantization). Corpora pequenos demais para treinar o
+        quantizador caem para um índice flat, que é exato.
+
+        `index_type='hnsw'` constrói um IndexHNSWFlat — travessia de grafo
+        com latência ~logarítmica por consulta, ideal para avaliações com
+        muitas consultas individuais (ex.: recall com dados anotados).
+        """
+        n, d = embeddings.shape
+
+        if index_type == 'hnsw':
+            # HNSW sobre códigos FP16: metade da banda de memória na
+            # travessia do grafo, com perda de recall desprezível
+            index = faiss.IndexHNSWSQ(d, faiss.ScalarQuantizer.QT_fp16, 32,
+                                      faiss.METRIC_INNER_PRODUCT)
+            index.hnsw.efConstruction = 200
+            index.train(embeddings)
+            return index
+        nlist = int(4 * math.sqrt(n))
+
+        # PQ com nbits=8 exige >= 256 vetores de treino e o FAISS recomenda
+        # ~39 pontos por centroide; abaixo disso, um scalar quantizer SQ8
+        # exato dá 4x de compressão sem precisar de clustering.
+        if n < 256 or nlist < 1:
+            index = faiss.IndexScalarQuantizer(
+                d, faiss.ScalarQuantizer.QT_8bit, faiss.METRIC_INNER_PRODUCT
+            )
+            index.train(embeddings)
+            return index
+
+        nlist = max(1, min(nlist, n // 39))
+        # m precisa dividir a dimensão; usa o maior subquantizador possível
+        m = next(m for m in (64, 32, 16, 8, 4, 2, 1) if d % m == 0)
+
+        quantizer = faiss.IndexFlatIP(d)
+        index = faiss.IndexIVFPQ(quantizer, d, nlist, m, 8, faiss.METRIC_INNER_PRODUCT)
+        index.train(embeddings)
+        return index
+
+    def build_vectorstore_from_embeddings(self, ids, embeddings, store_type='pedidos', persist_directory=None,
+                                          index_type='auto'):
         """
         Constrói um vectorstore a partir de embeddings pré-calculados.
-        (Refatorado para usar o método direto `FAISS.from_embeddings`)
+        (Refatorado para construir o índice FAISS nativamente, sem o overhead
+        do `FAISS.from_embeddings` — que cria um IndexFlatL2 de força bruta e
+        duplica os vetores em listas Python.)
         """
         print(f"Construindo vectorstore para {len(ids)} {store_type}...")
 
-        # Cria pares de (texto_placeholder, embedding)
-        text_embeddings = list(zip([""] * len(ids), embeddings.tolist()))
+        embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+        # O e5 é treinado para similaridade de cosseno: normaliza uma vez no
+        # build e usa produto interno (menos FLOPs por distância que L2 e o
+        # ranking que o modelo espera). Queries são normalizadas na busca.
+        faiss.normalize_L2(embeddings)
+        index = self._build_faiss_index(embeddings, index_type=index_type)
+        index.add(embeddings)
 
-        # Cria metadados com os IDs corretos
-        id_key = 'ProtocoloPedido' if store_type == 'pedidos' else 'IdRecurso'
-        metadatas = [{id_key: str(id_val)} for id_val in ids]
+        # Índice binário paralelo (32x menor que FP32; Hamming por popcount)
+        # para geração rápida de candidatos nos caminhos de over-retrieve
+        binary_index = self._build_binary_index(embeddings)
+        self._binary_indexes[store_type] = binary_index
 
-        # Usa o método direto do FAISS, que é mais simples e eficiente
-        vectorstore = FAISS.from_embeddings(
-            text_embeddings=text_embeddings,
-            embedding=self.embeddings,  # Fornece o embedder para futuras consultas
-            metadatas=metadatas
-        )
+        id_key = 'ProtocoloPedido' if store_type == 'pedidos' else 'IdRecurso'
+        ids_arr = np.array([str(id_val) for id_val in ids], dtype=object)
 
-        # Salvar e armazenar (lógica mantida)
+        # Persiste o índice nativo + sidecar parquet posição -> ID
         if persist_directory:
             os.makedirs(persist_directory, exist_ok=True)
-            save_path = os.path.join(persist_directory, f"{store_type}.faiss")
-            vectorstore.save_local(save_path)
-            print(f"Vectorstore salvo em {save_path}")
+            index_path = os.path.join(persist_directory, f"{store_type}.index")
+            faiss.write_index(index, index_path)
+            faiss.write_index_binary(
+                binary_index, os.path.join(persist_directory, f"{store_type}_binary.index"))
+            sidecar_path = os.path.join(persist_directory, f"{store_type}_meta.parquet")
+            pd.DataFrame({id_key: ids_arr}).to_parquet(sidecar_path)
+            print(f"Índice salvo em {index_path} (metadados em {sidecar_path})")
+
+        vectorstore = self._wrap_native_index(index, ids_arr, id_key)
 
         if store_type == 'pedidos':
             self.vectorstore_pedidos = vectorstore
@@ -170,32 +443,76 @@ class CGURecommendationPipeline:
 
         return vectorstore
 
+    @staticmethod
+    def _build_binary_index(embeddings):
+        """
+        Constrói um IndexBinaryFlat a partir do sinal dos embeddings
+        (1 bit por dimensão via np.packbits). A distância de Hamming entre
+        os códigos aproxima bem o ranking de cosseno para candidate
+        generation, custando só alguns popcounts por vetor.
+        """
+        d = embeddings.shape[1]
+        codes = np.packbits(embeddings > 0, axis=1)
+        binary_index = faiss.IndexBinaryFlat(d)
+        binary_index.add(np.ascontiguousarray(codes))
+        return binary_index
+
+    def binary_candidate_selector(self, store_type, query_text, n):
+        """
+        Gera os n candidatos mais próximos no índice binário e devolve um
+        IDSelectorBatch com suas posições, para rerank exato (FP32) no
+        índice principal via id_selector. Retorna None se o store não tem
+        índice binário (formato legado), deixando o chamador seguir o
+        caminho tradicional.
+        """
+        binary_index = self._binary_indexes.get(store_type)
+        if binary_index is None:
+            return None
+        query_embedding = np.asarray(self._embed_query_cached(query_text), dtype=np.float32)
+        codes = np.packbits(query_embedding.reshape(1, -1) > 0, axis=1)
+        _, pos_arr = binary_index.search(np.ascontiguousarray(codes), n)
+        positions = pos_arr[0][pos_arr[0] >= 0]
+        if positions.size == 0:
+            return None
+        return faiss.IDSelectorBatch(np.asarray(positions, dtype=np.int64))
+
+    def _wrap_native_index(self, index, ids_arr, id_key):
+        """Envolve um índice FAISS nativo no wrapper fino do LangChain,
+        mantendo compatível o código de recuperação existente. Os metadados
+        vivem apenas no array de IDs; nada de N Documents vazios no build."""
+        # Em índices IVF, visita 16 células por consulta (trade-off
+        # recall/latência razoável para o e5; o default de 1 perde recall)
+        if hasattr(index, 'nprobe'):
+            index.nprobe = 16
+        return FAISS(
+            embedding_function=self.embeddings,
+            index=index,
+            docstore=_IdArrayDocstore(ids_arr, id_key),
+            index_to_docstore_id=_PositionalIdMap(len(ids_arr)),
+        )
+
     def prepare_documents_from_dataframe(self, df, text_column='sentence'):
         """
         Prepara documentos a partir de um DataFrame para uso no LangChain.
         (Refatorado para usar to_dict('records') para melhor performance)
         """
+        # Converte tipos numpy -> nativos em uma única passada colunar
+        # (tolist() roda em C), em vez de N x C isinstance-checks por valor
+        columns = {}
+        for col in df.columns:
+            values = df[col].tolist()
+            if df[col].dtype == object or pd.api.types.is_float_dtype(df[col]):
+                values = [None if (v is None or (isinstance(v, float) and v != v)) else v
+                          for v in values]
+            columns[col] = values
+
         documents = []
-        # Usar to_dict é muito mais rápido que iterrows
-        for record in df.to_dict('records'):
-            text = record.get(text_column)
-            if pd.isna(text) or text == '':
+        col_names = [c for c in df.columns if c != text_column]
+        for idx, text in enumerate(columns.get(text_column, [])):
+            if text is None or pd.isna(text) or text == '':
                 continue
 
-            # O metadata já é um dicionário limpo
-            metadata = {k: v for k, v in record.items() if k != text_column}
-
-            # Converte tipos numpy para tipos nativos do Python
-            for key, value in metadata.items():
-                if isinstance(value, np.integer):
-                    metadata[key] = int(value)
-                elif isinstance(value, np.floating):
-                    metadata[key] = float(value)
-                elif isinstance(value, np.ndarray):
-                    metadata[key] = value.tolist()
-                elif pd.isna(value):
-                    metadata[key] = None
-
+            metadata = {col: columns[col][idx] for col in col_names}
             doc = Document(page_content=str(text), metadata=metadata)
             documents.append(doc)
 
@@ -223,11 +540,8 @@ class CGURecommendationPipeline:
     def build_pedidos_vectorstore(self, df_pedidos, persist_directory=None):
         """Constrói o vectorstore para pedidos."""
         if 'sentence' not in df_pedidos.columns:
-            df_pedidos['sentence'] = (
-                    df_pedidos['ResumoSolicitacao'].fillna('')
-                    + ' <SEP> '
-                    + df_pedidos['DetalhamentoSolicitacao'].fillna('')
-            )
+            df_pedidos['sentence'] = df_pedidos['ResumoSolicitacao'].fillna('').str.cat(
+                df_pedidos['DetalhamentoSolicitacao'].fillna(''), sep=' <SEP> ')
         documents = self.prepare_documents_from_dataframe(df_pedidos)
         self.vectorstore_pedidos = self.create_vectorstore(
             documents, store_name="pedidos", persist_directory=persist_directory
@@ -237,11 +551,8 @@ class CGURecommendationPipeline:
     def build_recursos_vectorstore(self, df_recursos, persist_directory=None):
         """Constrói o vectorstore para recursos."""
         if 'sentence' not in df_recursos.columns:
-            df_recursos['sentence'] = (
-                    df_recursos['TipoRecurso'].fillna('')
-                    + ' <SEP> '
-                    + df_recursos['DescRecurso'].fillna('')
-            )
+            df_recursos['sentence'] = df_recursos['TipoRecurso'].fillna('').str.cat(
+                df_recursos['DescRecurso'].fillna(''), sep=' <SEP> ')
         documents = self.prepare_documents_from_dataframe(df_recursos)
         self.vectorstore_recursos = self.create_vectorstore(
             documents, store_name="recursos", persist_directory=persist_directory
@@ -249,15 +560,33 @@ class CGURecommendationPipeline:
         return self.vectorstore_recursos
 
     def load_vectorstore(self, path, store_name="pedidos"):
-        """Carrega um vectorstore salvo anteriormente."""
+        """Carrega um vectorstore salvo anteriormente.
+
+        Prefere o formato nativo (`{store_name}.index` + sidecar parquet);
+        cai para o formato antigo do `save_local` do LangChain se necessário.
+        """
+        index_path = os.path.join(path, f"{store_name}.index")
         store_path = os.path.join(path, f"{store_name}.faiss")
-        if not os.path.exists(store_path):
-            raise FileNotFoundError(f"Arquivo {store_path} não encontrado")
 
-        print(f"Carregando vectorstore de {store_path}...")
-        vectorstore = FAISS.load_local(
-            store_path, self.embeddings, allow_dangerous_deserialization=True
-        )
+        if os.path.exists(index_path):
+            print(f"Carregando índice nativo de {index_path}...")
+            index = faiss.read_index(index_path)
+            binary_path = os.path.join(path, f"{store_name}_binary.index")
+            if os.path.exists(binary_path):
+                self._binary_indexes[store_name] = faiss.read_index_binary(binary_path)
+            sidecar_path = os.path.join(path, f"{store_name}_meta.parquet")
+            id_key = 'ProtocoloPedido' if store_name == 'pedidos' else 'IdRecurso'
+            sidecar = pd.read_parquet(sidecar_path)
+            id_col = id_key if id_key in sidecar.columns else sidecar.columns[0]
+            ids_arr = sidecar[id_col].astype(str).to_numpy(dtype=object)
+            vectorstore = self._wrap_native_index(index, ids_arr, id_key)
+        elif os.path.exists(store_path):
+            print(f"Carregando vectorstore de {store_path}...")
+            vectorstore = FAISS.load_local(
+                store_path, self.embeddings, allow_dangerous_deserialization=True
+            )
+        else:
+            raise FileNotFoundError(f"Nenhum índice encontrado para '{store_name}' em {path}")
 
         if store_name == "pedidos":
             self.vectorstore_pedidos = vectorstore
@@ -265,7 +594,59 @@ class CGURecommendationPipeline:
             self.vectorstore_recursos = vectorstore
         return vectorstore
 
-    def _find_similar(self, vectorstore, id_column, df, query_text=None, query_id=None, k=10, filter_query=False):
+    @staticmethod
+    def _sentence_lookup(df, id_column):
+        """
+        Índice hash id -> sentence, cacheado no próprio DataFrame (via
+        `df.attrs`). Substitui o scan booleano O(N) por lookup O(1) em
+        varreduras com milhares de consultas sobre o mesmo DataFrame.
+        """
+        cache_key = f'_cgu_sentence_by_{id_column}'
+        mapping = df.attrs.get(cache_key)
+        if mapping is None:
+            mapping = dict(zip(df[id_column].astype(str), df['sentence']))
+            df.attrs[cache_key] = mapping
+        return mapping
+
+    def _embed_query_cached(self, query_text):
+        """Embeda a query com cache (varreduras de k repetem as mesmas queries)."""
+        embedding = self._query_embedding_cache.get(query_text)
+        if embedding is None:
+            # Mesmo contexto de inferência (autocast) dos loops de corpus
+            with self._inference_ctx():
+                embedding = np.asarray(self.embeddings.embed_query(query_text), dtype=np.float32)
+            # Índices são construídos sobre vetores normalizados (métrica IP)
+            norm = np.linalg.norm(embedding)
+            if norm > 0:
+                embedding = embedding / norm
+            embedding = embedding.tolist()
+            # Cap simples para não crescer sem limite em serviços longos
+            if len(self._query_embedding_cache) >= 10000:
+                self._query_embedding_cache.clear()
+            self._query_embedding_cache[query_text] = embedding
+        return embedding
+
+    def embed_queries(self, query_texts):
+        """
+        Embeda um lote de queries numa única passada do encoder, povoando o
+        cache usado por _embed_query_cached. Uma passada batched amortiza o
+        overhead por chamada (launch de kernels, tokenização) que domina o
+        custo de embedar queries uma a uma sob carga concorrente.
+        """
+        pending = [q for q in query_texts if q not in self._query_embedding_cache]
+        if pending:
+            with self._inference_ctx():
+                vectors = np.asarray(self.embeddings.embed_documents(pending), dtype=np.float32)
+            # Mesma normalização aplicada em _embed_query_cached (métrica IP)
+            faiss.normalize_L2(vectors)
+            if len(self._query_embedding_cache) + len(pending) >= 10000:
+                self._query_embedding_cache.clear()
+            for q, vec in zip(pending, vectors):
+                self._query_embedding_cache[q] = vec.tolist()
+        return [self._query_embedding_cache[q] for q in query_texts]
+
+    def _find_similar(self, vectorstore, id_column, df, query_text=None, query_id=None, k=10, filter_query=False,
+                      id_selector=None):
         """
         Método privado e genérico para encontrar itens similares.
         (Refatorado para unificar a lógica de busca)
@@ -278,22 +659,61 @@ class CGURecommendationPipeline:
             if df is None:
                 raise ValueError("DataFrame é necessário quando query_id é fornecido.")
 
-            item = df[df[id_column].astype(str) == query_id]
-            if item.empty:
+            sentence_by_id = self._sentence_lookup(df, id_column)
+            if query_id not in sentence_by_id:
                 raise ValueError(f"Item com ID {query_id} na coluna {id_column} não encontrado.")
-            query_text = item['sentence'].iloc[0]
+            query_text = sentence_by_id[query_id]
 
         if query_text is None:
             raise ValueError("É necessário fornecer query_text ou query_id + df")
 
         search_k = k + 1 if filter_query and query_id is not None else k
-        docs_with_scores = vectorstore.similarity_search_with_score(query=query_text, k=search_k)
-
-        if filter_query and query_id is not None:
+        query_embedding = self._embed_query_cached(query_text)
+
+        if isinstance(vectorstore.docstore, _IdArrayDocstore):
+            # Caminho nativo: chama o handle faiss direto e junta os
+            # resultados por indexação inteira no array de IDs, sem o
+            # round-trip de Documents/dicts do wrapper LangChain.
+            q = np.ascontiguousarray(query_embedding, dtype=np.float32).reshape(1, -1)
+            if id_selector is not None:
+                # Filtro na camada ANN: só as posições permitidas competem
+                if isinstance(vectorstore.index, faiss.IndexIVF):
+                    # Com um objeto de params o FAISS usa o nprobe dele (1
+                    # por padrão), ignorando o do índice — repassa o valor
+                    # tunado para não sondar uma célula só
+                    params = faiss.SearchParametersIVF(
+                        sel=id_selector, nprobe=vectorstore.index.nprobe)
+                elif isinstance(vectorstore.index, faiss.IndexHNSW):
+                    # IndexHNSW::search rejeita o SearchParameters base
+                    params = faiss.SearchParametersHNSW(sel=id_selector)
+                else:
+                    params = faiss.SearchParameters(sel=id_selector)
+                scores_arr, pos_arr = vectorstore.index.search(q, search_k, params=params)
+            else:
+                scores_arr, pos_arr = vectorstore.index.search(q, search_k)
+            store_ids = self._vectorstore_ids(vectorstore, id_column)
+            valid = pos_arr[0] >= 0
+            neighbor_ids = store_ids[np.clip(pos_arr[0], 0, None)][valid]
+            neighbor_scores = scores_arr[0][valid]
+            if filter_query and query_id is not None:
+                # Pós-filtro vetorizado do self-match: máscara booleana no
+                # array de IDs, antes de materializar qualquer Document
+                keep = neighbor_ids != query_id
+                neighbor_ids = neighbor_ids[keep][:k]
+                neighbor_scores = neighbor_scores[keep][:k]
             docs_with_scores = [
-                                   (doc, score) for doc, score in docs_with_scores
-                                   if str(doc.metadata.get(id_column)) != query_id
-                               ][:k]
+                (Document(page_content="", metadata={id_column: nid}), float(score))
+                for nid, score in zip(neighbor_ids, neighbor_scores)
+            ]
+        else:
+            docs_with_scores = vectorstore.similarity_search_with_score_by_vector(
+                embedding=query_embedding, k=search_k
+            )
+            if filter_query and query_id is not None:
+                docs_with_scores = [
+                                       (doc, score) for doc, score in docs_with_scores
+                                       if str(doc.metadata.get(id_column)) != query_id
+                                   ][:k]
 
         results = []
         for doc, score in docs_with_scores:
@@ -306,7 +726,8 @@ class CGURecommendationPipeline:
         docs = [doc for doc, _ in docs_with_scores]
         return docs, results_df
 
-    def find_similar_pedidos(self, query_text=None, query_id=None, df_pedidos=None, k=10, filter_query=False):
+    def find_similar_pedidos(self, query_text=None, query_id=None, df_pedidos=None, k=10, filter_query=False,
+                             id_selector=None):
         """Encontra pedidos similares a partir de um texto ou ID."""
         return self._find_similar(
             vectorstore=self.vectorstore_pedidos,
@@ -315,10 +736,12 @@ class CGURecommendationPipeline:
             query_text=query_text,
             query_id=query_id,
             k=k,
-            filter_query=filter_query
+            filter_query=filter_query,
+            id_selector=id_selector
         )
 
-    def find_similar_recursos(self, query_text=None, query_id=None, df_recursos=None, k=10, filter_query=False):
+    def find_similar_recursos(self, query_text=None, query_id=None, df_recursos=None, k=10, filter_query=False,
+                              id_selector=None):
         """Encontra recursos similares a partir de um texto ou ID."""
         return self._find_similar(
             vectorstore=self.vectorstore_recursos,
@@ -327,61 +750,135 @@ class CGURecommendationPipeline:
             query_text=query_text,
             query_id=query_id,
             k=k,
-            filter_query=filter_query
+            filter_query=filter_query,
+            id_selector=id_selector
         )
 
-    def batch_similar_search(self, query_ids, df, vectorstore_type='pedidos', k=10):
-        """Realiza busca em lote para vários IDs."""
-        all_results = []
-        id_field = 'ProtocoloPedido' if vectorstore_type == 'pedidos' else 'IdRecurso'
-
-        for qid in tqdm(query_ids, desc=f"Buscando similares para {len(query_ids)} {vectorstore_type}"):
-            try:
-                if vectorstore_type == 'pedidos':
-                    _, results = self.find_similar_pedidos(
-                        query_id=qid, df_pedidos=df, k=k, filter_query=True
-                    )
-                else:
-                    _, results = self.find_similar_recursos(
-                        query_id=qid, df_recursos=df, k=k, filter_query=True
-                    )
+    def _vectorstore_ids(self, vectorstore, id_field):
+        """Array posicional de IDs do docstore (cacheado por vectorstore)."""
+        if isinstance(vectorstore.docstore, _IdArrayDocstore):
+            return vectorstore.docstore.ids
+        cached = getattr(vectorstore, '_cgu_position_ids', None)
+        if cached is None:
+            cached = np.array([
+                str(vectorstore.docstore.search(vectorstore.index_to_docstore_id[i]).metadata.get(id_field))
+                for i in range(vectorstore.index.ntotal)
+            ], dtype=object)
+            vectorstore._cgu_position_ids = cached
+        return cached
+
+    def _vectorstore_positions(self, vectorstore, id_field):
+        """Dicionário ID -> posição no índice (cacheado por vectorstore)."""
+        cached = getattr(vectorstore, '_cgu_id_positions', None)
+        if cached is None:
+            ids = self._vectorstore_ids(vectorstore, id_field)
+            cached = {id_val: pos for pos, id_val in enumerate(ids)}
+            vectorstore._cgu_id_positions = cached
+        return cached
+
+    def make_id_selector(self, store_type, allowed_ids):
+        """
+        Cria um seletor FAISS que restringe a busca às posições dos IDs
+        dados. Com ele, o filtro acontece na própria camada ANN (nenhuma
+        distância é calculada para vetores fora do conjunto), em vez de
+        pós-filtrar em pandas depois de uma sobre-recuperação.
+        """
+        vectorstore = self.vectorstore_pedidos if store_type == 'pedidos' else self.vectorstore_recursos
+        id_field = 'ProtocoloPedido' if store_type == 'pedidos' else 'IdRecurso'
+        if vectorstore is None:
+            raise ValueError(f"Vectorstore de {store_type} não inicializado")
 
-                if not results.empty:
-                    results['query_id'] = qid
-                    results = results[['query_id', id_field, 'score', 'page_content']]
-                    all_results.append(results)
+        pos_by_id = self._vectorstore_positions(vectorstore, id_field)
+        positions = np.array(
+            [pos_by_id[i] for i in map(str, allowed_ids) if i in pos_by_id],
+            dtype='int64'
+        )
+        return faiss.IDSelectorBatch(positions)
 
-            except Exception as e:
-                print(f"Erro ao processar {vectorstore_type} {qid}: {e}")
+    def batch_similar_search(self, query_ids, df, vectorstore_type='pedidos', k=10):
+        """
+        Realiza busca em lote para vários IDs.
 
-        return pd.concat(all_results, ignore_index=True) if all_results else pd.DataFrame()
+        Em vez de uma chamada FAISS por consulta, embeda todos os textos de
+        uma vez e faz uma única busca matricial `index.search(Q, k+1)`, que
+        amortiza o overhead Python e aproveita o blocking interno do FAISS.
+        """
+        vectorstore = self.vectorstore_pedidos if vectorstore_type == 'pedidos' else self.vectorstore_recursos
+        id_field = 'ProtocoloPedido' if vectorstore_type == 'pedidos' else 'IdRecurso'
+        if vectorstore is None:
+            raise ValueError(f"Vectorstore de {vectorstore_type} não inicializado")
+
+        sentence_by_id = self._sentence_lookup(df, id_field)
+        valid_ids = [str(q) for q in query_ids if str(q) in sentence_by_id]
+        skipped = len(query_ids) - len(valid_ids)
+        if skipped:
+            print(f"Aviso: {skipped} IDs não encontrados no DataFrame foram ignorados")
+        if not valid_ids:
+            return pd.DataFrame()
+
+        print(f"Buscando similares para {len(valid_ids)} {vectorstore_type} (busca matricial)...")
+        texts = [str(sentence_by_id[qid]) for qid in valid_ids]
+        query_matrix = np.ascontiguousarray(
+            self.embeddings.embed_documents(texts), dtype=np.float32
+        )
+        faiss.normalize_L2(query_matrix)
+
+        # Busca k+1 para poder descartar o self-match de cada consulta
+        scores, positions = vectorstore.index.search(query_matrix, k + 1)
+
+        store_ids = self._vectorstore_ids(vectorstore, id_field)
+        flat_pos = positions.ravel()
+        flat_scores = scores.ravel()
+        flat_qids = np.repeat(np.array(valid_ids, dtype=object), k + 1)
+
+        # Pós-filtro vetorizado: remove posições inválidas (-1) e self-matches
+        valid_mask = flat_pos >= 0
+        neighbor_ids = store_ids[np.clip(flat_pos, 0, None)]
+        keep = valid_mask & (neighbor_ids != flat_qids)
+
+        results = pd.DataFrame({
+            'query_id': flat_qids[keep],
+            id_field: neighbor_ids[keep],
+            'score': flat_scores[keep],
+        })
+        # Mantém no máximo k vizinhos por consulta após o filtro
+        results = results.groupby('query_id', sort=False).head(k).reset_index(drop=True)
+        results['page_content'] = results[id_field].map(sentence_by_id)
+        return results
 
     def evaluate_with_annotated_data(self, df_annotated, df_pedidos, k_values=[1, 5, 10, 20, 50, 100]):
         """Avalia o desempenho do pipeline usando dados anotados."""
         if self.vectorstore_pedidos is None:
             raise ValueError("Vectorstore de pedidos não inicializado")
 
-        results = []
         unique_queries = df_annotated['NUP'].unique()
         print(f"Avaliando {len(unique_queries)} consultas com {len(df_annotated)} pares anotados")
 
+        # Busca uma única vez com k máximo por consulta; recall@k para os
+        # demais valores sai do fatiamento da lista ranqueada (elimina o
+        # loop externo de |k_values| buscas por consulta).
+        max_k = max(k_values)
+        ranked_by_query = {}
+        for query_nup in tqdm(unique_queries, desc=f"Buscando top-{max_k}",
+                              mininterval=1.0, miniters=max(1, len(unique_queries) // 200)):
+            try:
+                _, results_df = self.find_similar_pedidos(
+                    query_id=query_nup, df_pedidos=df_pedidos, k=max_k, filter_query=True
+                )
+                ranked_by_query[query_nup] = results_df['ProtocoloPedido'].tolist()
+            except ValueError as e:
+                print(f"Aviso: Ignorando query {query_nup} durante avaliação: {e}")
+
+        results = []
         for k in k_values:
             hits = 0
             total_pairs = 0
-            for query_nup in tqdm(unique_queries, desc=f"Avaliando com k={k}"):
+            for query_nup, ranked in ranked_by_query.items():
                 similar_nups = set(df_annotated[df_annotated['NUP'] == query_nup]['NUP_semelhante'])
                 if not similar_nups:
                     continue
-
-                try:
-                    _, results_df = self.find_similar_pedidos(
-                        query_id=query_nup, df_pedidos=df_pedidos, k=k, filter_query=True
-                    )
-                    predicted_nups = set(results_df['ProtocoloPedido'])
-                    hits += len(similar_nups.intersection(predicted_nups))
-                    total_pairs += len(similar_nups)
-                except ValueError as e:
-                    print(f"Aviso: Ignorando query {query_nup} durante avaliação: {e}")
+                hits += len(similar_nups.intersection(ranked[:k]))
+                total_pairs += len(similar_nups)
 
             recall = hits / total_pairs if total_pairs > 0 else 0
             results.append({'k': k, 'hits': hits, 'total_annotated_pairs': total_pairs, 'recall_at_k': recall})
@@ -10,4 +10,6 @@ DATA_DIR   = BASE_DIR / "data"                        # onde ficam parquet, .pkl
 VECTORS_DIR = DATA_DIR / "vetores"                    # subpasta específica p/ vetores
 MODEL_NAME  = os.getenv("EMBEDDING_MODEL",            # modelo de embedding a usar
                         "intfloat/multilingual-e5-base")
-DEVICE      = "cuda" if os.getenv("USE_CUDA", "false").lower() == "true" else "cpu"
\ No newline at end of file
+DEVICE      = "cuda" if os.getenv("USE_CUDA", "false").lower() == "true" else "cpu"
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND",    # "hf" (PyTorch) ou "onnx" (ONNX Runtime)
+                              "hf")
\ No newline at end of file
@@ -1,15 +1,18 @@
 # main.py
+import asyncio
 import logging
 import os
 import re
+from collections import OrderedDict
 from typing import List, Dict, Optional
 
 import cohere
 import pandas as pd
+import pyarrow.dataset as pads
 from dotenv import load_dotenv
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from langchain_core.documents import Document
 from pydantic import BaseModel
@@ -27,22 +30,43 @@ load_dotenv()
 COHERE_API_KEY = os.getenv("COHERE_API_KEY")
 if not COHERE_API_KEY:
     raise ValueError("A variável de ambiente COHERE_API_KEY não foi definida.")
-cohere_client = cohere.Client(api_key=COHERE_API_KEY)
+# Cliente assíncrono: a chamada HTTP ao LLM não bloqueia o event loop
+cohere_client = cohere.AsyncClient(api_key=COHERE_API_KEY)
 
 # ─── Carrega dados e pipeline de embeddings ────────────────────────────
+def _carregar_parquet(path, colunas_desejadas):
+    """
+    Abre o parquet como dataset Arrow e materializa apenas as colunas que
+    o serviço de fato consome, com backing ArrowDtype (as strings ficam
+    nos buffers contíguos do Arrow, sem cópia para objetos Python).
+    Colunas ausentes no arquivo são simplesmente ignoradas.
+    """
+    ds = pads.dataset(path, format="parquet")
+    nomes = set(ds.schema.names)
+    colunas = [c for c in colunas_desejadas if c in nomes]
+    return ds.to_table(columns=colunas).to_pandas(types_mapper=pd.ArrowDtype)
+
+
+COLUNAS_PEDIDOS = ["ProtocoloPedido", "OrgaoDestinatario", "Situacao", "DataRegistro",
+                   "ResumoSolicitacao", "DetalhamentoSolicitacao", "sentence"]
+COLUNAS_RECURSOS = ["IdRecurso", "ProtocoloPedido", "OrgaoPedido", "TipoRecurso",
+                    "DescRecurso", "TipoResposta", "sentence"]
+
 try:
     logger.info("Carregando dados...")
-    df_ped = pd.read_parquet(DATA_DIR / "dt_pedidos.parquet")
+    df_ped = _carregar_parquet(DATA_DIR / "dt_pedidos.parquet", COLUNAS_PEDIDOS)
     logger.info(f"Carregados {len(df_ped)} pedidos")
-    df_rec = pd.read_parquet(DATA_DIR / "dt_recursos.parquet")
+    df_rec = _carregar_parquet(DATA_DIR / "dt_recursos.parquet", COLUNAS_RECURSOS)
     logger.info(f"Carregados {len(df_rec)} recursos")
 
-    # Ajustes de colunas / tipos
+    # Ajustes de colunas / tipos. str.cat com na_rep funde fillna +
+    # concatenação num único kernel, sem as Series intermediárias do `+`
     if "sentence" not in df_ped.columns:
-        df_ped["sentence"] = (
-                    df_ped["ResumoSolicitacao"].fillna("") + " <SEP> " + df_ped["DetalhamentoSolicitacao"].fillna(""))
+        df_ped["sentence"] = df_ped["ResumoSolicitacao"].str.cat(
+            df_ped["DetalhamentoSolicitacao"], sep=" <SEP> ", na_rep="")
     if "sentence" not in df_rec.columns:
-        df_rec["sentence"] = (df_rec["TipoRecurso"].fillna("") + " <SEP> " + df_rec["DescRecurso"].fillna(""))
+        df_rec["sentence"] = df_rec["TipoRecurso"].str.cat(
+            df_rec["DescRecurso"], sep=" <SEP> ", na_rep="")
 
     df_ped["ProtocoloPedido"] = df_ped["ProtocoloPedido"].astype(str)
     df_rec["ProtocoloPedido"] = df_rec["ProtocoloPedido"].astype(str)
@@ -53,10 +77,39 @@ try:
 
     logger.info("Otimizando estruturas de dados para lookups rápidos...")
     RECURSO_IDS_SET = set(df_rec["IdRecurso"].unique())
+    if "TipoResposta" not in df_rec.columns:
+        df_rec["TipoResposta"] = "N/A"
+    # Layout SoA (coluna -> ndarray) só com os campos de fato consumidos,
+    # em vez de um dict Python por linha de recurso residente em RAM
     RECURSOS_POR_PEDIDO = {
-        name: group.to_dict('records')
-        for name, group in df_rec.groupby("ProtocoloPedido")
+        name: {
+            "IdRecurso": group["IdRecurso"].to_numpy(),
+            "TipoResposta": group["TipoResposta"].to_numpy(),
+        }
+        for name, group in df_rec.groupby("ProtocoloPedido")[["IdRecurso", "TipoResposta"]]
     }
+    # frozenset dedicado para o .isin da Rota 3: dict_keys cai no caminho
+    # genérico do pandas, o set hash-checa direto
+    PROTOCOLOS_COM_RECURSOS = frozenset(RECURSOS_POR_PEDIDO.keys())
+
+    # Índices hash para as rotas de busca direta por ID: lookup O(1) por
+    # request, em vez de um scan booleano O(N) no DataFrame inteiro
+    PEDIDO_POR_PROTOCOLO = {}
+    for rec in df_ped.to_dict('records'):
+        PEDIDO_POR_PROTOCOLO.setdefault(rec["ProtocoloPedido"], rec)
+    RECURSO_POR_ID = {}
+    for rec in df_rec.to_dict('records'):
+        RECURSO_POR_ID.setdefault(rec["IdRecurso"], rec)
+
+    # Bloco "Recursos Vinculados" pré-formatado por protocolo: o mesmo
+    # texto era remontado a cada documento renderizado em cada request
+    RECURSOS_FMT_POR_PEDIDO = {}
+    for protocolo, soa in RECURSOS_POR_PEDIDO.items():
+        linhas = [f"Recursos Vinculados: SIM ({len(soa['IdRecurso'])})"]
+        linhas.extend(
+            f"  - Recurso ID {id_rec}: Decisão '{resposta}'"
+            for id_rec, resposta in zip(soa["IdRecurso"], soa["TipoResposta"]))
+        RECURSOS_FMT_POR_PEDIDO[protocolo] = "\n".join(linhas) + "\n"
     logger.info("Otimizações de lookup concluídas.")
 
     logger.info("Inicializando pipeline de embeddings...")
@@ -65,6 +118,15 @@ try:
     pipe.load_vectorstore(VECTORS_DIR, "recursos")
     logger.info("Pipeline carregado com sucesso!")
 
+    # Seletor FAISS com os pedidos que têm recurso: a Rota 3 filtra na
+    # própria busca ANN, em vez de over-retrieve (k*5) + filtro em pandas
+    try:
+        SELECTOR_PEDIDOS_COM_RECURSOS = pipe.make_id_selector("pedidos", RECURSOS_POR_PEDIDO.keys())
+        logger.info("Seletor ANN de pedidos com recursos construído.")
+    except Exception as e:
+        SELECTOR_PEDIDOS_COM_RECURSOS = None
+        logger.warning(f"Seletor ANN indisponível ({e}); Rota 3 usará o filtro pós-busca.")
+
 except Exception as e:
     logger.error(f"Erro fatal ao carregar dados/pipeline: {e}", exc_info=True)
     raise
@@ -122,29 +184,97 @@ ENHANCED_PROMPT = """Você é um assistente especialista na Lei de Acesso à Inf
 RESPOSTA:"""
 
 
+# ─── Micro-batching de embeddings ──────────────────────────────────────
+class _MicroBatcher:
+    """
+    Agrupa queries de requisições concorrentes numa única passada do
+    encoder: coleta itens por uma janela curta (ou até encher o lote),
+    roda a função batched no threadpool e espalha os resultados de volta
+    via Futures. Sob carga, o custo fixo por forward é amortizado pelo
+    lote inteiro.
+    """
+
+    def __init__(self, fn, max_batch=32, window_ms=10):
+        self.fn = fn
+        self.max_batch = max_batch
+        self.window = window_ms / 1000.0
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._task = None
+
+    async def submit(self, item):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+        fut = asyncio.get_running_loop().create_future()
+        await self._queue.put((item, fut))
+        return await fut
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.window
+            while len(batch) < self.max_batch:
+                restante = deadline - loop.time()
+                if restante <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), restante))
+                except asyncio.TimeoutError:
+                    break
+            try:
+                results = await asyncio.to_thread(self.fn, [item for item, _ in batch])
+                for (_, fut), result in zip(batch, results):
+                    if not fut.done():
+                        fut.set_result(result)
+            except Exception as e:
+                for _, fut in batch:
+                    if not fut.done():
+                        fut.set_exception(e)
+
+
+# Uma forward pass por janela de 10 ms para todas as queries pendentes;
+# os vetores ficam no cache do pipeline e a recuperação os reutiliza
+embedding_batcher = _MicroBatcher(pipe.embed_queries)
+
+
 # ─── Funções auxiliares ────────
+# Regexes compiladas uma vez no load do módulo: evita a consulta ao cache
+# interno do `re` (com lock) a cada request no caminho quente do /chat
+_RE_PROTOCOLO = re.compile(r"\b\d{14,}\b")
+_RE_ID_RECURSO = re.compile(r"\b(\d{4,8})\b")
+_RE_TERMOS_RECURSO = re.compile(
+    r"recursos?|reclamação|indeferido|negado|deferido|decisão|recursal|recorrido",
+    re.IGNORECASE)
+
+
 def detectar_protocolo(texto: str) -> Optional[str]:
-    match = re.search(r"\b\d{14,}\b", texto)
+    match = _RE_PROTOCOLO.search(texto)
     return match.group() if match else None
 
 
 def detectar_id_recurso(texto: str) -> Optional[str]:
-    match = re.search(r"\b(\d{4,8})\b", texto)
+    match = _RE_ID_RECURSO.search(texto)
     if match and (num := match.group(1)) in RECURSO_IDS_SET:
         return num
     return None
 
 
 def menciona_recursos(texto: str) -> bool:
-    termos = ["recurso", "recursos", "reclamação", "indeferido", "negado", "deferido", "decisão", "recursal",
-              "recorrido"]
-    # Ativa se menciona um termo de recurso E NÃO é uma busca direta por ID de recurso
-    return any(t in texto.lower() for t in termos) and not detectar_id_recurso(texto)
+    # Uma única passada do autômato compilado, em vez de 9 scans `in`
+    # sobre texto.lower(). Ativa se menciona um termo de recurso E NÃO é
+    # uma busca direta por ID de recurso
+    return bool(_RE_TERMOS_RECURSO.search(texto)) and not detectar_id_recurso(texto)
+
 
+def buscar_recursos_do_pedido(protocolo: str) -> Optional[Dict]:
+    # Devolve o bloco SoA (coluna -> ndarray) direto do índice em memória;
+    # iterar com zip nos arrays alinhados evita dicts por linha
+    return RECURSOS_POR_PEDIDO.get(str(protocolo))
 
-def buscar_recursos_do_pedido(protocolo: str) -> pd.DataFrame:
-    recursos_list = RECURSOS_POR_PEDIDO.get(str(protocolo), [])
-    return pd.DataFrame(recursos_list)
+
+def contar_recursos(protocolo: str) -> int:
+    soa = RECURSOS_POR_PEDIDO.get(str(protocolo))
+    return 0 if soa is None else len(soa["IdRecurso"])
 
 
 def formatar_documento_detalhado(doc, idx=1, is_recurso=False):
@@ -159,12 +289,7 @@ def formatar_documento_detalhado(doc, idx=1, is_recurso=False):
         )
     else:
         protocolo = meta.get("ProtocoloPedido", "N/A")
-        recursos_v = buscar_recursos_do_pedido(str(protocolo))
-        recursos_str = "Recursos Vinculados: Não há.\n"
-        if not recursos_v.empty:
-            recursos_str = f"Recursos Vinculados: SIM ({len(recursos_v)})\n"
-            for rec in recursos_v.to_dict('records'):
-                recursos_str += f"  - Recurso ID {rec.get('IdRecurso', 'N/A')}: Decisão '{rec.get('TipoResposta', 'N/A')}'\n"
+        recursos_str = RECURSOS_FMT_POR_PEDIDO.get(str(protocolo), "Recursos Vinculados: Não há.\n")
         return (
             f"--- [Documento {idx}: PEDIDO] ---\n"
             f"Protocolo: {protocolo}\n"
@@ -176,6 +301,28 @@ def formatar_documento_detalhado(doc, idx=1, is_recurso=False):
 
 
 # ─── LÓGICA DE RECUPERAÇÃO DE CONTEXTO ─────────────────────────────────
+# Cache LRU de (query normalizada, k) -> (context, sources): perguntas
+# repetidas (FAQs) pulam embedding + ANN + pandas inteiros. Os dados são
+# carregados uma vez no startup, então não há invalidação a fazer em runtime.
+_CONTEXT_CACHE: OrderedDict = OrderedDict()
+_CONTEXT_CACHE_MAX = 1024
+
+
+def get_enhanced_context_cached(query: str, k: int):
+    key = (query.strip().lower(), k)
+    hit = _CONTEXT_CACHE.get(key)
+    if hit is not None:
+        _CONTEXT_CACHE.move_to_end(key)
+        context, sources = hit
+        # Cópia rasa das sources: o chamador não muta o que está no cache
+        return context, [dict(s) for s in sources]
+    context, sources = get_enhanced_context(query, k)
+    _CONTEXT_CACHE[key] = (context, sources)
+    if len(_CONTEXT_CACHE) > _CONTEXT_CACHE_MAX:
+        _CONTEXT_CACHE.popitem(last=False)
+    return context, [dict(s) for s in sources]
+
+
 def get_enhanced_context(query: str, k: int):
     try:
         # Rota 1: Busca direta por ID de protocolo
@@ -186,14 +333,18 @@ def get_enhanced_context(query: str, k: int):
         if id_recurso := detectar_id_recurso(query):
             return _contexto_por_id_recurso(id_recurso)
 
+        # Detecção única para as Rotas 3 e 4: chegando aqui id_recurso é
+        # None, então menciona_recursos se reduz à regex de termos
+        menciona = bool(_RE_TERMOS_RECURSO.search(query))
+
         # Rota 3: Pergunta complexa que cruza pedidos e recursos
-        if menciona_recursos(query):
+        if menciona:
             contexto, sources = _contexto_busca_pedidos_com_recursos(query, k)
             if sources:  # Se a busca multi-etapas encontrou algo, use-a.
                 return contexto, sources
 
         # Rota 4: Busca genérica por recursos (se a Rota 3 não funcionou)
-        if menciona_recursos(query) and pipe.vectorstore_recursos:
+        if menciona and pipe.vectorstore_recursos:
             return _contexto_busca_recursos(query, k)
 
         # Rota 5 (Padrão): Busca genérica por pedidos
@@ -207,12 +358,32 @@ def get_enhanced_context(query: str, k: int):
 # ------------------------ HELPER DE CONTEXTO: BUSCA MULTI-ETAPAS -------------------------
 def _contexto_busca_pedidos_com_recursos(query: str, k: int):
     logger.info(f"Executando busca multi-etapas para: '{query}'")
-    # ETAPA 1: Busca um número maior de pedidos sobre o tema para ter mais chances de encontrar um com recurso
-    docs_pedidos, results_df = pipe.find_similar_pedidos(query, df_pedidos=df_ped, k=k * 5)
-
-    # ETAPA 2: Filtra os resultados para manter apenas os que têm recursos
-    pedidos_com_recursos_indices = results_df['ProtocoloPedido'].isin(RECURSOS_POR_PEDIDO.keys())
-    resultados_filtrados = results_df[pedidos_com_recursos_indices]
+    if SELECTOR_PEDIDOS_COM_RECURSOS is not None:
+        # Caminho rápido: o filtro acontece dentro do FAISS, então k
+        # resultados já chegam todos com recurso vinculado
+        docs_pedidos, results_df = pipe.find_similar_pedidos(
+            query, df_pedidos=df_ped, k=k, id_selector=SELECTOR_PEDIDOS_COM_RECURSOS)
+        resultados_filtrados = results_df
+    else:
+        # ETAPA 1: Busca um número maior de pedidos sobre o tema para ter mais chances de encontrar um com recurso.
+        # A geração dos k*5 candidatos usa o índice binário (Hamming/popcount,
+        # 32x menos memória) quando disponível; o rerank exato acontece no
+        # índice FP32 restrito a esses candidatos.
+        sel_binario = pipe.binary_candidate_selector("pedidos", query, k * 5)
+        docs_pedidos, results_df = pipe.find_similar_pedidos(
+            query, df_pedidos=df_ped, k=k * 5, id_selector=sel_binario)
+
+        # ETAPA 2: Filtra os resultados para manter apenas os que têm
+        # recursos. Passada única com early-exit em k sobre o array de
+        # protocolos, sem a máquina de .isin/máscara/head do pandas
+        protocolos = results_df['ProtocoloPedido'].to_numpy()
+        indices_filtrados = []
+        for i, protocolo in enumerate(protocolos):
+            if protocolo in PROTOCOLOS_COM_RECURSOS:
+                indices_filtrados.append(i)
+                if len(indices_filtrados) == k:
+                    break
+        resultados_filtrados = results_df.iloc[indices_filtrados]
 
     if resultados_filtrados.empty:
         logger.info("Nenhum pedido com recurso encontrado na busca multi-etapas.")
@@ -220,12 +391,16 @@ def _contexto_busca_pedidos_com_recursos(query: str, k: int):
 
     # ETAPA 3: Monta o contexto e as fontes com os resultados filtrados
     resultados_finais = resultados_filtrados.head(k)
-    docs_finais = [doc for doc in docs_pedidos if
-                   doc.metadata['ProtocoloPedido'] in resultados_finais['ProtocoloPedido'].values]
+    # Indexa os docs por protocolo uma vez e projeta na ordem do ranking:
+    # O(k), em vez do scan linear no array .values para cada doc (O(k²))
+    doc_por_protocolo = {doc.metadata['ProtocoloPedido']: doc for doc in docs_pedidos}
+    docs_finais = [doc_por_protocolo[p] for p in resultados_finais['ProtocoloPedido'].tolist()
+                   if p in doc_por_protocolo]
 
-    context = "[PEDIDOS COM RECURSOS VINCULADOS ENCONTRADOS NA BUSCA]\n"
-    for i, doc in enumerate(docs_finais, 1):
-        context += formatar_documento_detalhado(doc, i) + "\n\n"
+    # "".join linear, em vez de += quadrático no tamanho total do contexto
+    parts = ["[PEDIDOS COM RECURSOS VINCULADOS ENCONTRADOS NA BUSCA]"]
+    parts.extend(formatar_documento_detalhado(doc, i) for i, doc in enumerate(docs_finais, 1))
+    context = "\n\n".join(parts)
 
     sources = []
     for _, row in resultados_finais.iterrows():
@@ -237,16 +412,15 @@ def _contexto_busca_pedidos_com_recursos(query: str, k: int):
             "situacao": row.get("Situacao", "N/A"),
             "score": float(row.get("score", 0)),
             "resumo": (row.get("page_content") or "")[:200] + "...",
-            "num_recursos": len(RECURSOS_POR_PEDIDO.get(protocolo, [])),
+            "num_recursos": contar_recursos(protocolo),
         })
     return context, sources
 
 
 # ------------------------ HELPERS DE CONTEXTO: BUSCAS DIRETAS E SIMPLES -------------------------
 def _contexto_por_protocolo(protocolo: str):
-    pedido_espec = df_ped[df_ped["ProtocoloPedido"] == protocolo]
-    if pedido_espec.empty: return f"Não foi encontrado nenhum pedido com o protocolo {protocolo}.", []
-    pedido = pedido_espec.iloc[0].to_dict()
+    pedido = PEDIDO_POR_PROTOCOLO.get(str(protocolo))
+    if pedido is None: return f"Não foi encontrado nenhum pedido com o protocolo {protocolo}.", []
     contexto_doc = Document(page_content=pedido.get('sentence', ''), metadata=pedido)
     context = "[PEDIDO ESPECÍFICO ENCONTRADO]\n" + formatar_documento_detalhado(contexto_doc)
     sources = [{
@@ -254,15 +428,14 @@ def _contexto_por_protocolo(protocolo: str):
         "data": pedido.get("DataRegistro"),
         "situacao": pedido.get("Situacao"), "score": 1.0,
         "resumo": (pedido.get("ResumoSolicitacao") or "")[:200] + "...",
-        "num_recursos": len(RECURSOS_POR_PEDIDO.get(protocolo, [])),
+        "num_recursos": contar_recursos(protocolo),
     }]
     return context, sources
 
 
 def _contexto_por_id_recurso(id_recurso: str):
-    rec_df = df_rec[df_rec["IdRecurso"] == id_recurso]
-    if rec_df.empty: return f"Não foi encontrado nenhum recurso com o ID {id_recurso}.", []
-    rec = rec_df.iloc[0].to_dict()
+    rec = RECURSO_POR_ID.get(str(id_recurso))
+    if rec is None: return f"Não foi encontrado nenhum recurso com o ID {id_recurso}.", []
     contexto_doc = Document(page_content=rec.get('sentence', ''), metadata=rec)
     context = "[RECURSO ESPECÍFICO ENCONTRADO]\n" + formatar_documento_detalhado(contexto_doc, is_recurso=True)
     sources = [{
@@ -276,8 +449,9 @@ def _contexto_por_id_recurso(id_recurso: str):
 def _contexto_busca_recursos(query: str, k: int):
     docs, results = pipe.find_similar_recursos(query, df_recursos=df_rec, k=k)
     if not docs: return "Nenhum recurso relevante foi encontrado.", []
-    context = "[RECURSOS ENCONTRADOS NA BUSCA POR SIMILARIDADE]\n"
-    for i, doc in enumerate(docs, 1): context += formatar_documento_detalhado(doc, i, is_recurso=True) + "\n"
+    parts = ["[RECURSOS ENCONTRADOS NA BUSCA POR SIMILARIDADE]"]
+    parts.extend(formatar_documento_detalhado(doc, i, is_recurso=True) for i, doc in enumerate(docs, 1))
+    context = "\n".join(parts)
     sources = [{"protocolo": row.get("ProtocoloPedido"), "orgao": row.get("OrgaoPedido"), "data": "N/A",
                 "situacao": f"Recurso ID {row.get('IdRecurso')} - {row.get('TipoResposta', 'N/A')}",
                 "score": float(row.get("score", 0)), "resumo": (row.get("page_content") or "")[:200] + "..."}
@@ -288,15 +462,16 @@ def _contexto_busca_recursos(query: str, k: int):
 def _contexto_busca_pedidos(query: str, k: int):
     docs, results = pipe.find_similar_pedidos(query, df_pedidos=df_ped, k=k)
     if not docs: return "Nenhum pedido relevante foi encontrado.", []
-    context = "[PEDIDOS ENCONTRADOS NA BUSCA POR SIMILARIDADE]\n"
-    for i, doc in enumerate(docs, 1): context += formatar_documento_detalhado(doc, i) + "\n"
+    parts = ["[PEDIDOS ENCONTRADOS NA BUSCA POR SIMILARIDADE]"]
+    parts.extend(formatar_documento_detalhado(doc, i) for i, doc in enumerate(docs, 1))
+    context = "\n".join(parts)
     sources = []
     for _, row in results.iterrows():
         protocolo = str(row.get("ProtocoloPedido"))
         sources.append({"protocolo": protocolo, "orgao": row.get("OrgaoDestinatario"), "data": row.get("DataRegistro"),
                         "situacao": row.get("Situacao"), "score": float(row.get("score", 0)),
                         "resumo": (row.get("page_content") or "")[:200] + "...",
-                        "num_recursos": len(RECURSOS_POR_PEDIDO.get(protocolo, []))})
+                        "num_recursos": contar_recursos(protocolo)})
     return context, sources
 
 
@@ -305,10 +480,16 @@ def _contexto_busca_pedidos(query: str, k: int):
 async def chat_enhanced(req: ChatRequest):
     try:
         logger.info(f"Pergunta recebida: '{req.message[:60]}...' (k={req.k})")
-        context, sources = get_enhanced_context(req.message, req.k)
+        # Pré-embeda a query via micro-batcher: requisições concorrentes
+        # compartilham uma única passada do encoder e a recuperação abaixo
+        # encontra o vetor já no cache do pipeline
+        await embedding_batcher.submit(req.message)
+        # Recuperação é CPU-bound (torch + faiss): roda no threadpool para
+        # não travar o event loop e serializar as requisições concorrentes
+        context, sources = await asyncio.to_thread(get_enhanced_context_cached, req.message, req.k)
         if not sources: return ChatResponse(answer=context or "Não encontrei informações sobre isso.", sources=[])
         prompt = ENHANCED_PROMPT.format(context=context, question=req.message)
-        response = cohere_client.chat(model="command-r-plus", message=prompt, temperature=0.1, p=0.9)
+        response = await cohere_client.chat(model="command-r-plus", message=prompt, temperature=0.1, p=0.9)
         answer = response.text.strip()
         if "RESPOSTA:" in answer: answer = answer.split("RESPOSTA:")[-1].strip()
         logger.info(f"Resposta gerada: '{answer[:80]}...'")
@@ -318,6 +499,39 @@ async def chat_enhanced(req: ChatRequest):
         raise HTTPException(status_code=500, detail=f"Ocorreu um erro interno: {e}")
 
 
+@app.post("/chat/stream")
+async def chat_stream(req: ChatRequest):
+    """
+    Variante streaming do /chat: devolve os tokens via SSE conforme o
+    Cohere os gera. O tempo até o primeiro token cai da geração inteira
+    para um RTT; as fontes vão num evento final após o texto.
+    """
+    import json
+
+    logger.info(f"Pergunta (stream) recebida: '{req.message[:60]}...' (k={req.k})")
+    await embedding_batcher.submit(req.message)
+    context, sources = await asyncio.to_thread(get_enhanced_context_cached, req.message, req.k)
+
+    async def gerar():
+        try:
+            if not sources:
+                payload = json.dumps({"text": context or "Não encontrei informações sobre isso."})
+                yield f"data: {payload}\n\n"
+            else:
+                prompt = ENHANCED_PROMPT.format(context=context, question=req.message)
+                async for event in cohere_client.chat_stream(
+                        model="command-r-plus", message=prompt, temperature=0.1, p=0.9):
+                    if event.event_type == "text-generation":
+                        yield f"data: {json.dumps({'text': event.text})}\n\n"
+                yield f"data: {json.dumps({'sources': sources})}\n\n"
+            yield "data: [DONE]\n\n"
+        except Exception as e:
+            logger.error(f"Erro no endpoint /chat/stream: {e}", exc_info=True)
+            yield f"data: {json.dumps({'error': str(e)})}\n\n"
+
+    return StreamingResponse(gerar(), media_type="text/event-stream")
+
+
 # ─── Endpoints de Apoio ────────────────────────────────────────────────
 @app.get("/", include_in_schema=False)
 async def root(): return FileResponse("static/index.html")
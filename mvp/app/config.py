@@ -25,6 +25,14 @@ class Settings(BaseSettings):
         default=6333,
         description="Porta do servidor Qdrant"
     )
+    qdrant_grpc_port: int = Field(
+        default=6334,
+        description="Porta gRPC do servidor Qdrant"
+    )
+    qdrant_prefer_grpc: bool = Field(
+        default=True,
+        description="Usa o transporte gRPC (proto binário) em vez de REST/JSON"
+    )
     qdrant_timeout: int = Field(
         default=30,
         description="Timeout para conexões Qdrant em segundos"
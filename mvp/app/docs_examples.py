@@ -0,0 +1,58 @@
+# docs_examples.py
+"""
+Exemplos de payload para a documentação OpenAPI.
+
+Mantidos fora de models.py de propósito: só são importados quando
+OPENAPI_EXAMPLES=1, então workers de produção atrás de um gateway (que
+nunca servem /openapi.json) não pagam a memória nem o tempo de montagem
+desses dicts a cada import.
+"""
+
+EXAMPLES = {
+    "SimilarAppeal": {
+        "id": 12345,
+        "score": 0.85,
+        "description": "Solicito acesso aos contratos...",
+        "response": "No exercício das atribuições...",
+        "decision": "Indeferido",
+        "instance": "CGU"
+    },
+    "AnalysisResult": {
+        "likely_decision": "Provavelmente Indeferido",
+        "decision_stats": {
+            "Indeferido": {"count": 3, "percentage": 60.0},
+            "Deferido": {"count": 2, "percentage": 40.0}
+        },
+        "similar_appeals": []
+    },
+    "AnalysisResultWithDraft": {
+        "likely_decision": "Provavelmente Indeferido",
+        "decision_stats": {},
+        "similar_appeals": [],
+        "draft_response": "DECISÃO\n\nConsiderando o recurso interposto...",
+        "generation_metadata": {
+            "model_used": "llama3-70b-8192",
+            "tokens_used": 1500,
+            "generation_time": "~2 segundos"
+        }
+    },
+    "SimilarRequest": {
+        "id": 54321,
+        "protocol": "25820.123456/2023-11",
+        "score": 0.92,
+        "summary": "Acesso a contratos públicos",
+        "details": "Solicitação de acesso aos contratos...",
+        "decision": "Deferido"
+    },
+    "ProtocolSearchResult": {
+        "original_request": {
+            "id": 12345,
+            "protocol": "60110003084201855",
+            "score": 1.0,
+            "summary": "Solicitação de contratos",
+            "details": "Prezados, venho solicitar...",
+            "decision": "Acesso Concedido"
+        },
+        "similar_requests": []
+    },
+}
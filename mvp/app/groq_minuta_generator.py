@@ -1,78 +1,131 @@
 # groq_minuta_generator.py
+import asyncio
+import hashlib
+import json
+import logging
 import os
 import time
+import uuid
+from collections import OrderedDict, deque
+from itertools import islice
+from operator import itemgetter
 from typing import List, Dict, Optional, Any
 
-from groq import Groq
+import httpx
+from groq import AsyncGroq, RateLimitError
 
+logger = logging.getLogger(__name__)
 
-class GroqMinutaGenerator:
-    def __init__(self, api_key: Optional[str] = None):
-        """
-        Inicializa o gerador com a API key do Groq
 
-        API Key gratuita: https://console.groq.com/keys
-        """
-        self.api_key = api_key or os.getenv("GROQ_API_KEY")
-        if not self.api_key:
-            raise ValueError("GROQ_API_KEY não encontrada. Defina a variável de ambiente ou passe como parâmetro.")
+class RateLimited(Exception):
+    """
+    Limite de requisições do provedor atingido. Propagada até o endpoint
+    para virar um HTTP 429 com Retry-After, em vez de ser engolida no
+    fallback — clientes fazem backoff em vez de amplificar a carga.
+    """
 
-        self.client = Groq(api_key=self.api_key)
-        # Modelo recomendado: rápido e de qualidade
-        self.model = "llama3-70b-8192"
-        
-        # Rate limiting
-        self.max_requests_per_minute = 30
-        self.request_timestamps = []
+    def __init__(self, retry_after: int = 30):
+        super().__init__(f"Rate limit do Groq atingido; tente novamente em {retry_after}s")
+        self.retry_after = retry_after
 
-    def format_similar_cases(self, similar_cases: List[Dict]) -> str:
-        """Formata casos similares para o prompt"""
-        if not similar_cases:
-            return "Nenhum precedente similar encontrado."
 
-        formatted = ""
-        for i, case in enumerate(similar_cases[:3], 1):  # Top 3 casos
-            formatted += f"""
-        PRECEDENTE {i} (Score: {case.get('score', 0):.2f}):
-        - ID: {case.get('id')}
-        - Recurso: "{case.get('description', '')[:300]}..."
-        - Decisão Final: {case.get('decision')}
-        - Instância: {case.get('instance')}
-        - Resposta da CGU: "{case.get('response', '')[:400]}..."
-        
-        """
-        return formatted
+class MinutaBatchQueue:
+    """
+    Fila para o Batch API do Groq (50% do custo do modo síncrono).
 
-    def format_decision_stats(self, decision_stats: Dict) -> str:
-        """Formata estatísticas de decisão"""
-        if not decision_stats:
-            return "Nenhuma estatística disponível."
+    Minutas são revisadas por um servidor antes da publicação, então não
+    precisam de resposta sub-segundo: as requisições acumulam num buffer,
+    um flusher periódico sobe o JSONL e cria o batch, e um poller resolve
+    os jobs quando o arquivo de saída fica pronto.
+    """
 
-        stats_text = "📊 ESTATÍSTICAS DE DECISÕES SIMILARES:\n"
-        total_cases = sum(data['count'] for data in decision_stats.values())
+    def __init__(self, client, model: str, flush_interval_s: int = 60, poll_interval_s: int = 30):
+        self.client = client
+        self.model = model
+        self.flush_interval_s = flush_interval_s
+        self.poll_interval_s = poll_interval_s
+        self._pending: List[Dict] = []
+        self._jobs: Dict[str, Dict] = {}
+        self._active_batches: Dict[str, List[str]] = {}
+        self._tasks_started = False
 
-        for decision, data in sorted(decision_stats.items(),
-                                     key=lambda x: x[1]['percentage'], reverse=True):
-            stats_text += f"• {decision}: {data['count']} casos ({data['percentage']}%)\n"
+    def submit(self, messages: List[Dict], **params) -> str:
+        """Enfileira uma requisição de chat e retorna o id do job."""
+        custom_id = uuid.uuid4().hex
+        self._pending.append({
+            "custom_id": custom_id,
+            "method": "POST",
+            "url": "/v1/chat/completions",
+            "body": {"model": self.model, "messages": messages, **params},
+        })
+        self._jobs[custom_id] = {"status": "queued", "minuta": None}
+        self._ensure_tasks()
+        return custom_id
 
-        stats_text += f"\nTotal de precedentes analisados: {total_cases} casos"
-        return stats_text
+    def job_status(self, job_id: str) -> Optional[Dict]:
+        return self._jobs.get(job_id)
 
-    def generate_minuta(self, appeal_text: str, similar_cases: List[Dict],
-                        prediction: str, decision_stats: Dict) -> Dict[str, str]:
-        """
-        Gera minuta oficial usando Groq
+    def _ensure_tasks(self):
+        # Tarefas criadas sob demanda para só exigir event loop ativo
+        # quando o modo batch é de fato usado
+        if not self._tasks_started:
+            asyncio.get_running_loop()
+            asyncio.create_task(self._flush_loop())
+            asyncio.create_task(self._poll_loop())
+            self._tasks_started = True
 
-        Returns:
-            Dict com 'minuta' e 'metadata'
-        """
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval_s)
+            try:
+                await self._flush()
+            except Exception as e:
+                logger.exception("Erro no flush do batch Groq")
 
-        # Preparar dados contextuais
-        similar_cases_text = self.format_similar_cases(similar_cases)
-        stats_text = self.format_decision_stats(decision_stats)
+    async def _flush(self):
+        if not self._pending:
+            return
+        lines, self._pending = self._pending, []
+        payload = "\n".join(json.dumps(line) for line in lines).encode("utf-8")
+        uploaded = await self.client.files.create(
+            file=("minutas_batch.jsonl", payload), purpose="batch")
+        batch = await self.client.batches.create(
+            input_file_id=uploaded.id,
+            endpoint="/v1/chat/completions",
+            completion_window="24h",
+        )
+        self._active_batches[batch.id] = [line["custom_id"] for line in lines]
+        for line in lines:
+            self._jobs[line["custom_id"]]["status"] = "submitted"
+
+    async def _poll_loop(self):
+        while True:
+            await asyncio.sleep(self.poll_interval_s)
+            for batch_id in list(self._active_batches):
+                try:
+                    batch = await self.client.batches.retrieve(batch_id)
+                except Exception as e:
+                    logger.exception(f"Erro ao consultar batch {batch_id}")
+                    continue
+                if batch.status == "completed":
+                    content = await self.client.files.content(batch.output_file_id)
+                    for raw in content.text.splitlines():
+                        record = json.loads(raw)
+                        job = self._jobs.get(record.get("custom_id"))
+                        if job is not None:
+                            job["status"] = "done"
+                            job["minuta"] = (record["response"]["body"]
+                                             ["choices"][0]["message"]["content"])
+                    del self._active_batches[batch_id]
+                elif batch.status in ("failed", "expired", "cancelled"):
+                    for custom_id in self._active_batches.pop(batch_id):
+                        self._jobs[custom_id]["status"] = batch.status
 
-        # Prompt otimizado para qualidade jurídica
-        system_prompt = """Você é um servidor sênior da CGU (Controladoria-Geral da União) com 15 anos de experiência em Lei de Acesso à Informação (LAI). 
+
+# Prompts estáticos em constantes de módulo: o texto multi-KB é alocado
+# uma vez no import, e por requisição só a cauda dinâmica passa pelo
+# .format com os quatro campos variáveis
+_SYSTEM_PROMPT = """Você é um servidor sênior da CGU (Controladoria-Geral da União) com 15 anos de experiência em Lei de Acesso à Informação (LAI). 
 
         Sua expertise inclui:
         - Lei 12.527/2011 (LAI)
@@ -82,53 +135,224 @@ class GroqMinutaGenerator:
         
         RESPONSABILIDADE: Gerar minutas de alta qualidade técnica que servirão como base para decisões oficiais da CGU."""
 
-        user_prompt = f"""TAREFA: Gere uma minuta de resposta oficial para o recurso LAI apresentado.
-
-        📋 RECURSO INTERPOSTO:
+_DYNAMIC_TAIL_TMPL = """📋 RECURSO INTERPOSTO:
         {appeal_text}
-        
+
         {similar_cases_text}
-        
+
         {stats_text}
-        
+
         🤖 PREDIÇÃO IA: {prediction}
-        
+
+        MINUTA:"""
+
+
+class GroqMinutaGenerator:
+    # Instruções estáticas no topo do prompt de usuário: provedores com
+    # prompt caching só cacheiam *prefixos*, então todo o conteúdo que não
+    # varia entre requisições fica numa mensagem própria e imutável, e os
+    # campos dinâmicos (recurso, precedentes, estatísticas, predição) vão
+    # por último. Em modelos sem caching o reordenamento é neutro.
+    STATIC_INSTRUCTIONS = """TAREFA: Gere uma minuta de resposta oficial para o recurso LAI que será apresentado ao final.
+
         📝 INSTRUÇÕES PARA A MINUTA:
-        
+
         1. **ESTRUTURA OBRIGATÓRIA:**
            - Cabeçalho "DECISÃO"
            - Seção "CONSIDERANDO" (fundamentação)
            - Seção "DECIDO" (dispositivo)
            - Identificação de prazos recursais
-        
+
         2. **FUNDAMENTAÇÃO JURÍDICA:**
            - Cite artigos específicos da Lei 12.527/2011
            - Referencie o Decreto 7.724/2012
            - Use precedentes similares quando relevante
            - Mantenha consistência com a jurisprudência
-        
+
         3. **QUALIDADE TÉCNICA:**
            - Linguagem formal e jurídica apropriada
            - Argumentação clara e objetiva
            - Conclusão coerente com os precedentes
            - Praticidade para o servidor revisar
-        
+
         4. **DECISÃO BASEADA EM DADOS:**
            - Considere as estatísticas apresentadas
            - Justifique com base nos precedentes
            - Se divergir da predição, explique os motivos
+
+        IMPORTANTE: Esta minuta será revisada por um servidor antes da publicação oficial. Foque na qualidade técnica e consistência jurídica."""
+
+    def __init__(self, api_key: Optional[str] = None):
+        """
+        Inicializa o gerador com a API key do Groq
+
+        API Key gratuita: https://console.groq.com/keys
+        """
+        self.api_key = api_key or os.getenv("GROQ_API_KEY")
+        if not self.api_key:
+            raise ValueError("GROQ_API_KEY não encontrada. Defina a variável de ambiente ou passe como parâmetro.")
+
+        # Cliente assíncrono sobre um único httpx.AsyncClient: as conexões
+        # TCP/TLS ficam no pool e são reutilizadas entre as requisições,
+        # e a chamada ao LLM (~2s) não segura um worker thread inteiro
+        self._http_client = httpx.AsyncClient()
+        self.client = AsyncGroq(api_key=self.api_key, http_client=self._http_client)
+        # Modelo recomendado: rápido e de qualidade
+        self.model = "llama3-70b-8192"
         
-        IMPORTANTE: Esta minuta será revisada por um servidor antes da publicação oficial. Foque na qualidade técnica e consistência jurídica.
-        
-        MINUTA:"""
+        # Rate limiting por token bucket: reabastece a taxa constante e
+        # admite rajadas até a capacidade; antes o limite era só declarado
+        # (request_timestamps nunca era alimentado) e rajadas estouravam
+        # em 429 no lado do Groq
+        self.max_requests_per_minute = 30
+        self._bucket = float(self.max_requests_per_minute)
+        self._bucket_capacity = float(self.max_requests_per_minute)
+        self._refill_rate = self.max_requests_per_minute / 60.0
+        self._last_refill = time.monotonic()
+        self._bucket_lock = asyncio.Lock()
+        # Trilha de auditoria das admissões (janela de 60s): deque aparada
+        # pela frente a cada admissão — O(1) amortizado e memória limitada,
+        # usada apenas para observabilidade em get_usage_stats
+        self.request_timestamps = deque()
+
+        # Fila opcional do Batch API (modo não-interativo, 50% do custo)
+        self.batch_queue = MinutaBatchQueue(self.client, self.model)
+
+        # Cache content-addressed de minutas: entradas idênticas (demos,
+        # cliques repetidos, retries idempotentes) não pagam o LLM de novo
+        self._minuta_cache: OrderedDict = OrderedDict()
+        self._minuta_cache_max = 1024
+        self._minuta_cache_ttl_s = 3600
+
+    def format_similar_cases(self, similar_cases: List[Dict]) -> str:
+        """Formata casos similares para o prompt"""
+        if not similar_cases:
+            return "Nenhum precedente similar encontrado."
+
+        # append + join: montagem linear, em vez do += quadrático; islice
+        # evita copiar a lista e o truncamento só fatia (aloca) quando o
+        # texto de fato excede o limite
+        parts = []
+        for i, case in enumerate(islice(similar_cases, 3), 1):  # Top 3 casos
+            desc = case.get('description') or ''
+            if len(desc) > 300:
+                desc = desc[:300]
+            resp = case.get('response') or ''
+            if len(resp) > 400:
+                resp = resp[:400]
+            parts.append(f"""
+        PRECEDENTE {i} (Score: {case.get('score', 0):.2f}):
+        - ID: {case.get('id')}
+        - Recurso: "{desc}..."
+        - Decisão Final: {case.get('decision')}
+        - Instância: {case.get('instance')}
+        - Resposta da CGU: "{resp}..."
+
+        """)
+        return "".join(parts)
+
+    def format_decision_stats(self, decision_stats: Dict) -> str:
+        """Formata estatísticas de decisão"""
+        if not decision_stats:
+            return "Nenhuma estatística disponível."
+
+        total_cases = sum(data['count'] for data in decision_stats.values())
+
+        # Tuplas (percentual, decisão, contagem) ordenadas por itemgetter:
+        # sem lambda por comparação, e o join monta o texto numa passada
+        ordenadas = sorted(
+            ((data['percentage'], decision, data['count'])
+             for decision, data in decision_stats.items()),
+            key=itemgetter(0), reverse=True)
+
+        linhas = ["📊 ESTATÍSTICAS DE DECISÕES SIMILARES:"]
+        linhas.extend(f"• {decision}: {count} casos ({percentage}%)"
+                      for percentage, decision, count in ordenadas)
+        linhas.append(f"\nTotal de precedentes analisados: {total_cases} casos")
+        return "\n".join(linhas)
+
+    async def _acquire(self, cost: float = 1.0):
+        """
+        Consome `cost` tokens do bucket, aguardando o reabastecimento se
+        necessário — back-pressure local em vez de 429s do provedor.
+        """
+        async with self._bucket_lock:
+            now = time.monotonic()
+            self._bucket = min(self._bucket_capacity,
+                               self._bucket + (now - self._last_refill) * self._refill_rate)
+            self._last_refill = now
+            if self._bucket < cost:
+                espera = (cost - self._bucket) / self._refill_rate
+                await asyncio.sleep(espera)
+                self._bucket = 0.0
+                self._last_refill = time.monotonic()
+            else:
+                self._bucket -= cost
+            admitido = time.monotonic()
+            while self.request_timestamps and admitido - self.request_timestamps[0] >= 60:
+                self.request_timestamps.popleft()
+            self.request_timestamps.append(admitido)
+
+    @staticmethod
+    def _cache_key(appeal_text: str, similar_cases: List[Dict],
+                   prediction: str, decision_stats: Dict) -> str:
+        """Hash estável do conteúdo que determina a minuta."""
+        raw = "|".join([
+            appeal_text,
+            prediction,
+            ",".join(sorted(str(case.get("id")) for case in similar_cases)),
+            json.dumps(decision_stats, sort_keys=True, default=str),
+        ])
+        return hashlib.blake2b(raw.encode("utf-8")).hexdigest()
+
+    def _build_messages(self, appeal_text: str, similar_cases: List[Dict],
+                        prediction: str, decision_stats: Dict) -> List[Dict]:
+        """Monta as mensagens da minuta: system + instruções estáticas +
+        cauda dinâmica (ordem pensada para prompt caching por prefixo)."""
+
+        # Preparar dados contextuais
+        similar_cases_text = self.format_similar_cases(similar_cases)
+        stats_text = self.format_decision_stats(decision_stats)
+
+        dynamic_tail = _DYNAMIC_TAIL_TMPL.format(
+            appeal_text=appeal_text,
+            similar_cases_text=similar_cases_text,
+            stats_text=stats_text,
+            prediction=prediction,
+        )
+
+        return [
+            {"role": "system", "content": _SYSTEM_PROMPT},
+            {"role": "user", "content": self.STATIC_INSTRUCTIONS},
+            {"role": "user", "content": dynamic_tail},
+        ]
+
+    async def generate_minuta(self, appeal_text: str, similar_cases: List[Dict],
+                              prediction: str, decision_stats: Dict) -> Dict[str, str]:
+        """
+        Gera minuta oficial usando Groq
+
+        Returns:
+            Dict com 'minuta' e 'metadata'
+        """
+        cache_key = self._cache_key(appeal_text, similar_cases, prediction, decision_stats)
+        cached = self._minuta_cache.get(cache_key)
+        if cached is not None:
+            cached_at, result = cached
+            if time.time() - cached_at < self._minuta_cache_ttl_s:
+                self._minuta_cache.move_to_end(cache_key)
+                return {"minuta": result["minuta"],
+                        "metadata": {**result["metadata"], "cache_hit": True}}
+            del self._minuta_cache[cache_key]
+
+        messages = self._build_messages(
+            appeal_text, similar_cases, prediction, decision_stats)
+        await self._acquire()
 
         try:
-            response = self.client.chat.completions.create(
+            response = await self.client.chat.completions.create(
                 model=self.model,
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_prompt}
-                ],
+                messages=messages,
                 temperature=0.1,  # Baixa criatividade para consistência
                 max_tokens=1500,
                 top_p=0.9
@@ -136,7 +360,7 @@ class GroqMinutaGenerator:
 
             minuta = response.choices[0].message.content.strip()
 
-            return {
+            result = {
                 "minuta": minuta,
                 "metadata": {
                     "model_used": self.model,
@@ -146,7 +370,21 @@ class GroqMinutaGenerator:
                     "prediction_confidence": prediction
                 }
             }
+            # Só respostas reais entram no cache (fallbacks ficam de fora)
+            self._minuta_cache[cache_key] = (time.time(), result)
+            if len(self._minuta_cache) > self._minuta_cache_max:
+                self._minuta_cache.popitem(last=False)
+            return result
 
+        except RateLimitError as e:
+            # 429 do provedor não vira fallback: sobe estruturado para o
+            # endpoint devolver 429 + Retry-After ao cliente
+            retry_after = 30
+            try:
+                retry_after = int(e.response.headers.get("retry-after", retry_after))
+            except (AttributeError, TypeError, ValueError):
+                pass
+            raise RateLimited(retry_after) from e
         except Exception as e:
             return {
                 "minuta": self.generate_fallback_minuta(appeal_text, prediction),
@@ -181,10 +419,57 @@ class GroqMinutaGenerator:
         ---
         OBSERVAÇÃO TÉCNICA: Minuta gerada automaticamente com base em análise de precedentes. Deve ser revisada e personalizada pelo servidor competente antes da publicação oficial."""
 
-    def test_api_connection(self) -> bool:
+    async def generate_minuta_stream(self, appeal_text: str, similar_cases: List[Dict],
+                                     prediction: str, decision_stats: Dict):
+        """
+        Gera a minuta em streaming: async generator que emite cada pedaço
+        de texto conforme o Groq o produz (stream=True), em vez de esperar
+        os ~1500 tokens completos. Em caso de erro, emite a minuta de
+        fallback de uma vez.
+        """
+        messages = self._build_messages(
+            appeal_text, similar_cases, prediction, decision_stats)
+        await self._acquire()
+        try:
+            stream = await self.client.chat.completions.create(
+                model=self.model,
+                messages=messages,
+                temperature=0.1,
+                max_tokens=1500,
+                top_p=0.9,
+                stream=True
+            )
+            async for chunk in stream:
+                delta = chunk.choices[0].delta.content
+                if delta:
+                    yield delta
+        except Exception as e:
+            logger.exception("Erro no streaming da minuta; usando fallback")
+            yield self.generate_fallback_minuta(appeal_text, prediction)
+
+    def enqueue_minuta(self, appeal_text: str, similar_cases: List[Dict],
+                       prediction: str, decision_stats: Dict) -> str:
+        """
+        Enfileira a geração da minuta no Batch API e retorna o id do job.
+        O resultado sai depois via batch_job_status (janela de até 24h).
+        """
+        messages = self._build_messages(
+            appeal_text, similar_cases, prediction, decision_stats)
+        return self.batch_queue.submit(
+            messages,
+            temperature=0.1,
+            max_tokens=1500,
+            top_p=0.9,
+        )
+
+    def batch_job_status(self, job_id: str) -> Optional[Dict]:
+        """Consulta o estado de um job enfileirado no Batch API."""
+        return self.batch_queue.job_status(job_id)
+
+    async def test_api_connection(self) -> bool:
         """Testa se a API está funcionando"""
         try:
-            response = self.client.chat.completions.create(
+            response = await self.client.chat.completions.create(
                 model=self.model,
                 messages=[{"role": "user", "content": "Teste: responda apenas 'OK'"}],
                 max_tokens=10
@@ -197,13 +482,19 @@ class GroqMinutaGenerator:
     
     def get_usage_stats(self) -> Dict[str, Any]:
         """Retorna estatísticas de uso do gerador."""
-        now = time.time()
-        recent_requests = [ts for ts in self.request_timestamps if now - ts < 60]
-        
+        # Projeta o estado atual do bucket sem consumir tokens
+        now = time.monotonic()
+        disponivel = min(self._bucket_capacity,
+                         self._bucket + (now - self._last_refill) * self._refill_rate)
+
+        while self.request_timestamps and now - self.request_timestamps[0] >= 60:
+            self.request_timestamps.popleft()
+
         return {
-            "requests_last_minute": len(recent_requests),
+            "rate_limit_remaining": int(disponivel),
+            "requests_last_minute": len(self.request_timestamps),
             "max_requests_per_minute": self.max_requests_per_minute,
-            "rate_limit_remaining": max(0, self.max_requests_per_minute - len(recent_requests)),
+            "refill_rate_per_s": self._refill_rate,
             "model": self.model,
             "api_key_configured": bool(self.api_key)
         }
\ No newline at end of file
@@ -1,5 +1,10 @@
+import asyncio
+import hashlib
 import os
 import logging
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
 from pathlib import Path
 from dotenv import load_dotenv
 
@@ -12,68 +17,73 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-from fastapi import FastAPI, HTTPException
+import jinja2
+from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import Response
+from fastapi.responses import ORJSONResponse, Response, StreamingResponse
 from qdrant_client import QdrantClient, models
 from langchain_huggingface import HuggingFaceEmbeddings
-from typing import List
+from typing import List, Optional
 
-from app.models import AppealQuery, AnalysisResult, SimilarRequest, AnalysisResultWithDraft, ProtocolSearchResult
+from app.models import (AppealQuery, AnalysisResult, SimilarRequest, AnalysisResultWithDraft,
+                        ProtocolSearchResult, SimilarAppeal, DecisionStat)
 from datetime import datetime
 import app.services as services
-from app.groq_minuta_generator import GroqMinutaGenerator
+from app.groq_minuta_generator import GroqMinutaGenerator, RateLimited
 from app.config import settings, setup_logging, validate_environment, print_startup_info
 
 # Configura logging antes de criar a aplicação
 setup_logging()
 
-app = FastAPI(
-    title=settings.app_title,
-    description="API para análise de recursos e busca de contexto em pedidos da LAI com geração automática de minutas.",
-    version=settings.app_version,
-)
 
-# Configuração CORS
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["http://localhost:3000", "http://127.0.0.1:3000"],
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
-
-embedding_model = None
-qdrant_client = None
-minuta_generator = None
-
-
-@app.on_event("startup")
-def startup_event():
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Inicialização concorrente do serviço: o carregamento do modelo de
+    embedding (vários segundos de disco+CPU) e as checagens de coleção no
+    Qdrant são independentes, então rodam em paralelo via asyncio.gather —
+    o cold-start cai para o máximo das etapas em vez da soma delas.
+    """
     global embedding_model, qdrant_client, minuta_generator
     try:
         # Valida ambiente antes de inicializar
         if not validate_environment():
             logger.error("❌ Falha na validação do ambiente")
             raise Exception("Ambiente não está corretamente configurado")
-        
-        logger.info("Carregando modelo de embedding...")
-        embedding_model = HuggingFaceEmbeddings(model_name=settings.model_name)
-        logger.info("✅ Modelo de embedding carregado")
 
-        logger.info("Conectando ao Qdrant...")
+        logger.info("Carregando modelo de embedding e conectando ao Qdrant...")
+        # O construtor do QdrantClient é barato (conexão preguiçosa); as
+        # idas de rede acontecem nos get_collection dentro do gather
+        # prefer_grpc: vetores trafegam em proto binário numa conexão
+        # HTTP/2 multiplexada, em vez de floats serializados em JSON
         qdrant_client = QdrantClient(
-            host=settings.qdrant_host, 
+            host=settings.qdrant_host,
             port=settings.qdrant_port,
+            grpc_port=settings.qdrant_grpc_port,
+            prefer_grpc=settings.qdrant_prefer_grpc,
             timeout=settings.qdrant_timeout
         )
-
-        recursos_info = qdrant_client.get_collection(settings.qdrant_recursos_collection)
-        pedidos_info = qdrant_client.get_collection(settings.qdrant_pedidos_collection)
+        embedding_model, recursos_info, pedidos_info = await asyncio.gather(
+            asyncio.to_thread(HuggingFaceEmbeddings, model_name=settings.model_name),
+            asyncio.to_thread(qdrant_client.get_collection, settings.qdrant_recursos_collection),
+            asyncio.to_thread(qdrant_client.get_collection, settings.qdrant_pedidos_collection),
+        )
+        logger.info("✅ Modelo de embedding carregado")
         logger.info("✅ Conectado ao Qdrant")
         logger.info(f"  - Coleção de Recursos: {recursos_info.points_count} pontos")
         logger.info(f"  - Coleção de Pedidos: {pedidos_info.points_count} pontos")
 
+        # Índice keyword em 'instance' permite facetar valores distintos
+        # no servidor (usado por /instances); idempotente se já existir
+        try:
+            qdrant_client.create_payload_index(
+                collection_name=settings.qdrant_recursos_collection,
+                field_name="instance",
+                field_schema=models.PayloadSchemaType.KEYWORD,
+            )
+        except Exception as e:
+            logger.warning(f"Não foi possível garantir o índice de payload 'instance': {e}")
+
         logger.info("Inicializando gerador de minutas...")
         if settings.groq_api_key:
             minuta_generator = GroqMinutaGenerator(
@@ -83,6 +93,12 @@ def startup_event():
         else:
             logger.warning("⚠️ GROQ_API_KEY não configurada - Geração de minutas desativada")
 
+        # defer_build adiou a construção dos schemas Pydantic no import;
+        # construí-los aqui evita que a primeira requisição pague o custo
+        for model in (AppealQuery, AnalysisResult, AnalysisResultWithDraft,
+                      SimilarRequest, ProtocolSearchResult):
+            model.model_rebuild()
+
         # Exibe informações de inicialização
         print_startup_info()
 
@@ -90,6 +106,147 @@ def startup_event():
         logger.error(f"❌ Erro crítico na inicialização: {e}")
         raise
 
+    yield
+
+
+app = FastAPI(
+    title=settings.app_title,
+    description="API para análise de recursos e busca de contexto em pedidos da LAI com geração automática de minutas.",
+    version=settings.app_version,
+    # orjson serializa em C e devolve bytes direto; nos endpoints de
+    # análise (listas grandes de casos similares) isso tira o json.dumps
+    # puro-Python do caminho crítico
+    default_response_class=ORJSONResponse,
+    lifespan=lifespan,
+)
+
+# Configuração CORS
+app.add_middleware(
+    CORSMiddleware,
+    allow_origins=["http://localhost:3000", "http://127.0.0.1:3000"],
+    allow_credentials=True,
+    allow_methods=["*"],
+    allow_headers=["*"],
+)
+
+embedding_model = None
+qdrant_client = None
+minuta_generator = None
+
+
+class EmbeddingBatcher:
+    """
+    Micro-batching na frente do embed_query: chamadas concorrentes são
+    coletadas por uma janela curta e embedadas numa única passada de
+    embed_documents, que amortiza o custo de matmul/transfência muito
+    melhor que uma query por vez.
+    """
+
+    def __init__(self, window_ms: int = 10, max_batch: int = 32):
+        self.window = window_ms / 1000.0
+        self.max_batch = max_batch
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._task = None
+
+    async def embed(self, text: str):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+        fut = asyncio.get_running_loop().create_future()
+        await self._queue.put((text, fut))
+        return await fut
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.window
+            while len(batch) < self.max_batch:
+                restante = deadline - loop.time()
+                if restante <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), restante))
+                except asyncio.TimeoutError:
+                    break
+            try:
+                vectors = await asyncio.to_thread(
+                    embedding_model.embed_documents, [text for text, _ in batch])
+                for (_, fut), vector in zip(batch, vectors):
+                    if not fut.done():
+                        fut.set_result(vector)
+            except Exception as e:
+                for _, fut in batch:
+                    if not fut.done():
+                        fut.set_exception(e)
+
+
+embedding_batcher = EmbeddingBatcher()
+
+
+class SearchCoalescer:
+    """
+    Junta buscas quase simultâneas num único search_batch do Qdrant:
+    cada chamada registra um Future e o drenador envia todas as
+    requisições acumuladas na janela (5ms) numa única RPC, deixando o
+    Qdrant amortizar a travessia do HNSW entre as queries.
+    """
+
+    def __init__(self, window_ms: int = 5, max_batch: int = 32):
+        self.window = window_ms / 1000.0
+        self.max_batch = max_batch
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._task = None
+
+    async def search(self, collection_name, query_vector, query_filter, limit,
+                     score_threshold=None, with_payload=True):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+        fut = asyncio.get_running_loop().create_future()
+        request = models.SearchRequest(
+            vector=query_vector,
+            filter=query_filter,
+            limit=limit,
+            with_payload=with_payload,
+            score_threshold=score_threshold,
+        )
+        await self._queue.put((collection_name, request, fut))
+        return await fut
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.window
+            while len(batch) < self.max_batch:
+                restante = deadline - loop.time()
+                if restante <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), restante))
+                except asyncio.TimeoutError:
+                    break
+            # Uma RPC por coleção presente no lote
+            por_colecao = {}
+            for collection_name, request, fut in batch:
+                por_colecao.setdefault(collection_name, []).append((request, fut))
+            for collection_name, items in por_colecao.items():
+                try:
+                    results = await asyncio.to_thread(
+                        qdrant_client.search_batch,
+                        collection_name=collection_name,
+                        requests=[request for request, _ in items],
+                    )
+                    for (_, fut), result in zip(items, results):
+                        if not fut.done():
+                            fut.set_result(result)
+                except Exception as e:
+                    for _, fut in items:
+                        if not fut.done():
+                            fut.set_exception(e)
+
+
+search_coalescer = SearchCoalescer()
+
 
 @app.get("/", tags=["Status"])
 def root():
@@ -107,9 +264,21 @@ def root():
     }
 
 
+# Caches TTL para endpoints de polling (load balancers, dashboards):
+# /health evita duas idas ao Qdrant por chamada e /instances evita o
+# scroll de até 1000 pontos + construção de set a cada request
+_health_cache = None          # (monotonic, payload)
+_HEALTH_CACHE_TTL_S = 5
+_instances_cache = None       # (monotonic, payload)
+_INSTANCES_CACHE_TTL_S = 300
+
+
 @app.get("/health", tags=["Status"])
 def health_check():
     """Verifica a saúde do serviço e a conexão com o Qdrant."""
+    global _health_cache
+    if _health_cache and time.monotonic() - _health_cache[0] < _HEALTH_CACHE_TTL_S:
+        return _health_cache[1]
     try:
         recursos_info = qdrant_client.get_collection(collection_name=settings.qdrant_recursos_collection)
         pedidos_info = qdrant_client.get_collection(collection_name=settings.qdrant_pedidos_collection)
@@ -128,67 +297,90 @@ def health_check():
         
         if minuta_generator:
             health_data["groq_stats"] = minuta_generator.get_usage_stats()
-        
+
+        _health_cache = (time.monotonic(), health_data)
         return health_data
     except Exception as e:
         raise HTTPException(status_code=503, detail=f"Erro ao conectar com o Qdrant: {e}")
 
 
-@app.post("/analyze-appeal", response_model=AnalysisResult, tags=["Análise de Recursos"])
-def analyze_appeal(query: AppealQuery):
+async def _run_analysis(query: AppealQuery) -> dict:
     """
-    Analisa um recurso, aplicando filtros inteligentes, e retorna predição + casos similares.
-    Este é o endpoint principal de busca.
+    Núcleo da análise compartilhado pelos endpoints: embedding + busca no
+    Qdrant + estatísticas, devolvendo dicts puros. Os modelos Pydantic são
+    construídos apenas na borda da resposta de cada endpoint, então quem
+    consome os dados internamente (ex.: o gerador de minutas) não paga o
+    round-trip modelo -> .dict().
     """
-    try:
-        query_vector = embedding_model.embed_query(query.text)
+    # Micro-batcher: requisições concorrentes compartilham uma única
+    # passada do encoder (e o forward roda fora do event loop)
+    query_vector = await embedding_batcher.embed(query.text)
+
+    # --- LÓGICA DE FILTRO INTELIGENTE ---
+    filter_conditions = []
+    if query.instance_filter:
+        filter_conditions.append(
+            models.FieldCondition(key="instance", match=models.MatchValue(value=query.instance_filter))
+        )
 
-        # --- LÓGICA DE FILTRO INTELIGENTE ---
-        filter_conditions = []
-        if query.instance_filter:
+        if query.instance_filter.upper() == "CGU":
             filter_conditions.append(
-                models.FieldCondition(key="instance", match=models.MatchValue(value=query.instance_filter))
+                models.FieldCondition(key="context", match=models.MatchValue(value="orgao_demandado"))
             )
 
-            if query.instance_filter.upper() == "CGU":
-                filter_conditions.append(
-                    models.FieldCondition(key="context", match=models.MatchValue(value="orgao_demandado"))
-                )
-
-        # Monta o filtro final somente se houver condições
-        query_filter = models.Filter(must=filter_conditions) if filter_conditions else None
-
-        logger.debug(f"Filtro Qdrant aplicado: {query_filter}")
+    # Monta o filtro final somente se houver condições
+    query_filter = models.Filter(must=filter_conditions) if filter_conditions else None
+
+    logger.debug(f"Filtro Qdrant aplicado: {query_filter}")
+
+    search_results = await search_coalescer.search(
+        collection_name=settings.qdrant_recursos_collection,
+        query_vector=query_vector,
+        query_filter=query_filter,
+        limit=min(query.top_k, settings.max_search_results),
+        score_threshold=query.min_score,
+        # Projeta só os campos consumidos pelos formatadores: o Qdrant
+        # deixa de transferir o resto do payload de cada ponto
+        with_payload=models.PayloadSelectorInclude(
+            include=["decision", "instance", "description", "response"]
+        ),
+    )
+
+    if not search_results:
+        # Se não encontrou NADA, vamos dar uma mensagem de erro específica
+        if query_filter:
+            raise HTTPException(
+                status_code=404,
+                detail=f"Nenhum recurso similar encontrado que satisfaça os filtros aplicados: {query_filter}"
+            )
+        else:
+            raise HTTPException(
+                status_code=404,
+                detail="Nenhum recurso similar encontrado com os critérios especificados."
+            )
 
-        search_results = qdrant_client.search(
-            collection_name=settings.qdrant_recursos_collection,
-            query_vector=query_vector,
-            query_filter=query_filter,
-            limit=min(query.top_k, settings.max_search_results),
-            with_payload=True,
-            score_threshold=query.min_score
-        )
+    # Estatísticas + predição numa única travessia dos resultados
+    bundle = services.summarize(search_results)
 
-        if not search_results:
-            # Se não encontrou NADA, vamos dar uma mensagem de erro específica
-            if query_filter:
-                raise HTTPException(
-                    status_code=404,
-                    detail=f"Nenhum recurso similar encontrado que satisfaça os filtros aplicados: {query_filter}"
-                )
-            else:
-                raise HTTPException(
-                    status_code=404,
-                    detail="Nenhum recurso similar encontrado com os critérios especificados."
-                )
+    return {
+        "likely_decision": bundle.likely,
+        "decision_stats": bundle.stats,
+        "similar_appeals": services.format_similar_appeals_raw(search_results),
+    }
 
-        decision_stats = services.analyze_decision_stats(search_results)
 
-        return AnalysisResult(
-            likely_decision=services.determine_likely_decision(decision_stats),
-            decision_stats=decision_stats,
-            similar_appeals=services.format_similar_appeals(search_results),
-        )
+@app.post("/analyze-appeal", response_model=AnalysisResult, tags=["Análise de Recursos"])
+async def analyze_appeal(query: AppealQuery):
+    """
+    Analisa um recurso, aplicando filtros inteligentes, e retorna predição + casos similares.
+    Este é o endpoint principal de busca.
+    """
+    try:
+        # Os dicts de _run_analysis já têm a forma exata de AnalysisResult
+        # (dados confiáveis, validados na indexação): serializar direto
+        # evita materializar um DTO por hit e pula a revalidação do
+        # response_model e o jsonable_encoder do FastAPI
+        return ORJSONResponse(await _run_analysis(query))
     except HTTPException:
         raise
     except Exception as e:
@@ -196,47 +388,144 @@ def analyze_appeal(query: AppealQuery):
         raise HTTPException(status_code=500, detail=f"Ocorreu um erro interno: {e}")
 
 
-@app.post("/analyze-appeal-with-draft", response_model=AnalysisResultWithDraft, tags=["Análise de Recursos"])
-def analyze_appeal_with_draft(query: AppealQuery):
+# Replay de Idempotency-Key: entradas (monotonic, Future) com single-flight —
+# retries/double-clicks aguardam o Future da chamada original em vez de
+# disparar (e cobrar) uma segunda geração no Groq
+_IDEM_CACHE_TTL_S = 600
+_IDEM_CACHE_MAX = 256
+_idem_cache: OrderedDict = OrderedDict()
+
+
+def _montar_resultado_com_minuta(raw: dict, draft_response: str,
+                                 generation_metadata: Optional[dict]) -> AnalysisResultWithDraft:
     """
-    Analisa um recurso (usando a mesma lógica de /analyze-appeal) e adiciona uma minuta gerada por IA.
+    Monta a resposta via model_construct: os dados já foram validados
+    (análise própria + minuta gerada), então a saída não repete validadores
+    nem a medição do draft_response multi-KB.
     """
-    if not minuta_generator:
-        raise HTTPException(
-            status_code=501,
-            detail="Funcionalidade de geração de minutas não está disponível. Configure GROQ_API_KEY."
-        )
-
+    return AnalysisResultWithDraft.model_construct(
+        likely_decision=raw["likely_decision"],
+        decision_stats={k: DecisionStat.model_construct(**v)
+                        for k, v in raw["decision_stats"].items()},
+        similar_appeals=[SimilarAppeal.model_construct(**c)
+                         for c in raw["similar_appeals"]],
+        draft_response=draft_response,
+        generation_metadata=generation_metadata,
+    )
+
+
+async def _analisar_com_minuta(query: AppealQuery, mode: str) -> AnalysisResultWithDraft:
+    """Análise + geração da minuta (núcleo de /analyze-appeal-with-draft)."""
     try:
-        # 1. Reutiliza o endpoint de análise principal para obter os dados
-        analysis_result = analyze_appeal(query)
+        # 1. Reutiliza a mesma análise de /analyze-appeal, em dicts puros
+        raw = await _run_analysis(query)
+
+        # 2a. Modo batch: enfileira e devolve o id do job sem bloquear
+        if mode == "batch":
+            job_id = minuta_generator.enqueue_minuta(
+                appeal_text=query.text,
+                similar_cases=raw["similar_appeals"],
+                prediction=raw["likely_decision"],
+                decision_stats=raw["decision_stats"]
+            )
+            return _montar_resultado_com_minuta(
+                raw,
+                draft_response="Minuta enfileirada no Batch API; consulte /minuta-batch/{job_id}.",
+                generation_metadata={"batch_job_id": job_id, "status": "queued"}
+            )
 
-        # 2. Gera a minuta com base nos resultados da análise
-        result = minuta_generator.generate_minuta(
+        # 2b. Modo síncrono: gera a minuta com base nos resultados da
+        # análise; o await libera o event loop durante os ~2s da Groq
+        result = await minuta_generator.generate_minuta(
             appeal_text=query.text,
-            similar_cases=[case.dict() for case in analysis_result.similar_appeals],
-            prediction=analysis_result.likely_decision,
-            decision_stats=analysis_result.decision_stats
+            similar_cases=raw["similar_appeals"],
+            prediction=raw["likely_decision"],
+            decision_stats=raw["decision_stats"]
         )
-        draft_response = result.get("minuta", "Erro ao gerar minuta.")
-        generation_metadata = result.get("metadata", {})
 
         # 3. Combina os resultados e retorna
-        return AnalysisResultWithDraft(
-            likely_decision=analysis_result.likely_decision,
-            decision_stats=analysis_result.decision_stats,
-            similar_appeals=analysis_result.similar_appeals,
-            draft_response=draft_response,
-            generation_metadata=generation_metadata
+        return _montar_resultado_com_minuta(
+            raw,
+            draft_response=result.get("minuta", "Erro ao gerar minuta."),
+            generation_metadata=result.get("metadata", {})
         )
 
     except HTTPException:
         raise
+    except RateLimited as e:
+        # Envelope estável de 429: clientes reconhecem o código e fazem
+        # backoff exponencial guiado pelo Retry-After
+        raise HTTPException(
+            status_code=429,
+            detail={
+                "ok": False,
+                "code": "agent.rate_limited",
+                "message": "Limite de geração de minutas atingido; tente novamente mais tarde."
+            },
+            headers={"Retry-After": str(e.retry_after)}
+        )
     except Exception as e:
         logger.error(f"Erro na geração da minuta: {e}")
         raise HTTPException(status_code=500, detail=f"Ocorreu um erro na geração da minuta: {e}")
 
 
+@app.post("/analyze-appeal-with-draft", response_model=AnalysisResultWithDraft, tags=["Análise de Recursos"])
+async def analyze_appeal_with_draft(query: AppealQuery, request: Request, mode: str = "sync"):
+    """
+    Analisa um recurso (usando a mesma lógica de /analyze-appeal) e adiciona uma minuta gerada por IA.
+
+    Com `?mode=batch` a minuta vai para o Batch API do Groq (50% do custo):
+    a resposta sai imediatamente com o id do job em generation_metadata e o
+    resultado é consultado depois em /minuta-batch/{job_id}.
+
+    Aceita o header `Idempotency-Key`: repetições da mesma requisição
+    dentro de 10 minutos reaproveitam a resposta original (inclusive se a
+    geração ainda estiver em andamento), sem pagar uma segunda ida ao Groq.
+    """
+    if not minuta_generator:
+        raise HTTPException(
+            status_code=501,
+            detail="Funcionalidade de geração de minutas não está disponível. Configure GROQ_API_KEY."
+        )
+
+    idem_key = request.headers.get("Idempotency-Key")
+    if not idem_key:
+        resultado = await _analisar_com_minuta(query, mode)
+        return ORJSONResponse(resultado.model_dump(mode="json"))
+
+    # A chave combina o header com o hash do corpo: a mesma key com corpo
+    # diferente não colide (cliente reutilizando keys indevidamente)
+    corpo = hashlib.blake2b(f"{query.json()}|{mode}".encode("utf-8"),
+                            digest_size=16).hexdigest()
+    chave = f"{idem_key}:{corpo}"
+    agora = time.monotonic()
+
+    entrada = _idem_cache.get(chave)
+    if entrada is not None and agora - entrada[0] < _IDEM_CACHE_TTL_S:
+        _idem_cache.move_to_end(chave)
+        repetido = await asyncio.shield(entrada[1])
+        return ORJSONResponse(repetido.model_dump(mode="json"))
+
+    fut = asyncio.get_running_loop().create_future()
+    _idem_cache[chave] = (agora, fut)
+    while len(_idem_cache) > _IDEM_CACHE_MAX:
+        _idem_cache.popitem(last=False)
+
+    try:
+        resultado = await _analisar_com_minuta(query, mode)
+    except BaseException as e:
+        # Falhas não são cacheadas: a repetição tenta de novo
+        _idem_cache.pop(chave, None)
+        if not fut.done():
+            fut.set_exception(e)
+            fut.exception()  # marca como consumida p/ quem não estiver aguardando
+        raise
+
+    if not fut.done():
+        fut.set_result(resultado)
+    return ORJSONResponse(resultado.model_dump(mode="json"))
+
+
 # ... (O resto dos endpoints, como /context-by-protocol, /instances, etc. podem continuar os mesmos) ...
 
 @app.get("/similar-appeals/{appeal_id}", tags=["Contexto de Recursos"])
@@ -290,7 +579,9 @@ def find_similar_appeals(appeal_id: str, top_k: int = 5):
                 must_not=[models.HasIdCondition(has_id=[original_point.id])]
             ),
             limit=top_k,
-            with_payload=True
+            with_payload=models.PayloadSelectorInclude(
+                include=["description", "response", "decision", "instance"]
+            )
         )
 
         # Criar objeto para o recurso original encontrado
@@ -364,7 +655,9 @@ def find_similar_requests(protocol_id: str, top_k: int = 5):
                 must_not=[models.HasIdCondition(has_id=[original_point.id])]
             ),
             limit=top_k,
-            with_payload=True
+            with_payload=models.PayloadSelectorInclude(
+                include=["protocol", "summary", "details", "decision"]
+            )
         )
 
         # Criar objeto para o pedido original encontrado
@@ -389,10 +682,11 @@ def find_similar_requests(protocol_id: str, top_k: int = 5):
             ) for r in search_results
         ]
         
-        return ProtocolSearchResult(
+        result = ProtocolSearchResult(
             original_request=original_request,
             similar_requests=similar_requests
         )
+        return ORJSONResponse(result.model_dump(mode="json"))
     except HTTPException:
         raise
     except Exception as e:
@@ -405,20 +699,27 @@ def get_available_instances():
     """
     Retorna as instâncias disponíveis para filtro.
     """
+    global _instances_cache
+    if _instances_cache and time.monotonic() - _instances_cache[0] < _INSTANCES_CACHE_TTL_S:
+        return _instances_cache[1]
     try:
-        points, _ = qdrant_client.scroll(
+        # Agregação distinct no servidor via facet: uma RPC pequena com os
+        # valores únicos, em vez de puxar até 1000 payloads inteiros (e
+        # errado acima de 1000 pontos)
+        response = qdrant_client.facet(
             collection_name=settings.qdrant_recursos_collection,
-            limit=1000,
-            with_payload=True
+            key="instance",
+            limit=100,
         )
 
-        instances = set()
-        for point in points:
-            instance = point.payload.get("instance")
-            if instance and instance != "N/A":
-                instances.add(instance)
+        instances = sorted(
+            hit.value for hit in response.hits
+            if hit.value and hit.value != "N/A"
+        )
 
-        return {"instances": sorted(list(instances))}
+        payload = {"instances": instances}
+        _instances_cache = (time.monotonic(), payload)
+        return payload
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -444,62 +745,142 @@ def get_minuta_generation_status():
         }
 
 
-@app.post("/download-minuta", tags=["Geração de Minutas"])
-def download_minuta(data: dict):
+@app.post("/analyze-appeal-with-draft/stream", tags=["Análise de Recursos"])
+async def analyze_appeal_with_draft_stream(query: AppealQuery):
     """
-    Endpoint para download de minuta formatada.
-    Recebe os dados da análise e retorna um arquivo de texto para download.
+    Variante streaming: roda a análise e devolve a minuta por SSE conforme
+    os tokens chegam do Groq. O primeiro token alcança a UI em ~200ms, em
+    vez de esperar a geração completa; a análise vai num evento inicial e
+    os metadados num evento final.
     """
-    try:
-        # Extrair dados necessários
-        appeal_text = data.get('appeal_text', '')
-        draft_response = data.get('draft_response', '')
-        likely_decision = data.get('likely_decision', '')
-        decision_stats = data.get('decision_stats', {})
-        generation_metadata = data.get('generation_metadata', {})
-        similar_appeals_count = data.get('similar_appeals_count', 0)
-        
-        if not draft_response:
-            raise HTTPException(status_code=400, detail="Minuta não disponível para download")
-        
-        # Criar conteúdo formatado
-        now = datetime.now()
-        content = f"""MINUTA DE DECISÃO - CGU LAI
+    import json as _json
+
+    if not minuta_generator:
+        raise HTTPException(
+            status_code=501,
+            detail="Funcionalidade de geração de minutas não está disponível. Configure GROQ_API_KEY."
+        )
+
+    raw = await _run_analysis(query)
+
+    async def gerar():
+        yield "data: " + _json.dumps({
+            "likely_decision": raw["likely_decision"],
+            "decision_stats": raw["decision_stats"],
+        }) + "\n\n"
+        partes = []
+        async for delta in minuta_generator.generate_minuta_stream(
+                appeal_text=query.text,
+                similar_cases=raw["similar_appeals"],
+                prediction=raw["likely_decision"],
+                decision_stats=raw["decision_stats"]):
+            partes.append(delta)
+            yield "data: " + _json.dumps({"text": delta}) + "\n\n"
+        yield "data: " + _json.dumps({
+            "metadata": {
+                "model_used": minuta_generator.model,
+                "chars_generated": sum(len(p) for p in partes),
+                "similar_cases_count": len(raw["similar_appeals"]),
+                "prediction_confidence": raw["likely_decision"],
+            }
+        }) + "\n\n"
+        yield "data: [DONE]\n\n"
+
+    return StreamingResponse(gerar(), media_type="text/event-stream")
+
+
+@app.get("/minuta-batch/{job_id}", tags=["Geração de Minutas"])
+def get_minuta_batch_job(job_id: str):
+    """Consulta o resultado de uma minuta enfileirada via ?mode=batch."""
+    if not minuta_generator:
+        raise HTTPException(status_code=501, detail="Geração de minutas não está disponível.")
+    job = minuta_generator.batch_job_status(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job '{job_id}' não encontrado.")
+    return {"job_id": job_id, **job}
+
+
+
+# Template da minuta compilado uma vez no import: o hot path do download
+# vira um render() com loops em bytecode do Jinja2, em vez de f-string
+# gigante + comprehensions com chr(10).join por requisição
+# Cabeçalho estático pré-codificado em bytes no import: o encode UTF-8
+# por requisição fica restrito à parte dinâmica do documento
+_MINUTA_HEADER = """MINUTA DE DECISÃO - CGU LAI
 ===============================================
 
-Data de Geração: {now.strftime('%d/%m/%Y')} às {now.strftime('%H:%M:%S')}
+""".encode("utf-8")
+
+_MINUTA_TPL_SRC = """Data de Geração: {{ now.strftime('%d/%m/%Y') }} às {{ now.strftime('%H:%M:%S') }}
 
 RECURSO ANALISADO:
-{appeal_text}
+{{ appeal_text }}
 
 DECISÃO PROPOSTA:
-{likely_decision}
+{{ likely_decision }}
 
 MINUTA GERADA PELA IA:
 =====================
 
-{draft_response}
+{{ draft_response }}
 
 ===============================================
 INFORMAÇÕES TÉCNICAS:
 
-{chr(10).join([f"{key.replace('_', ' ').upper()}: {value}" for key, value in generation_metadata.items()]) if generation_metadata else 'Metadados não disponíveis'}
-
-CASOS SIMILARES ANALISADOS: {similar_appeals_count}
+{% if generation_metadata %}{% for key, value in generation_metadata.items() %}{{ key.replace('_', ' ').upper() }}: {{ value }}
+{% endfor %}{% else %}Metadados não disponíveis
+{% endif %}
+CASOS SIMILARES ANALISADOS: {{ similar_appeals_count }}
 
 ESTATÍSTICAS DE DECISÃO:
-{chr(10).join([f"{decision}: {stats['count']} casos ({stats['percentage']:.1f}%)" for decision, stats in decision_stats.items()]) if decision_stats else 'Estatísticas não disponíveis'}
-
+{% if decision_stats %}{% for decision, stats in decision_stats.items() %}{{ decision }}: {{ stats['count'] }} casos ({{ "%.1f"|format(stats['percentage']) }}%)
+{% endfor %}{% else %}Estatísticas não disponíveis
+{% endif %}
 ===============================================
 ⚠️  ATENÇÃO: Esta minuta foi gerada automaticamente por IA e REQUER REVISÃO MANUAL antes de ser utilizada oficialmente.
 ==============================================="""
+
+_minuta_env = jinja2.Environment(
+    loader=jinja2.DictLoader({"minuta.txt": _MINUTA_TPL_SRC}), auto_reload=False)
+_minuta_tpl = _minuta_env.get_template("minuta.txt")
+
+
+@app.post("/download-minuta", tags=["Geração de Minutas"])
+def download_minuta(data: dict):
+    """
+    Endpoint para download de minuta formatada.
+    Recebe os dados da análise e retorna um arquivo de texto para download.
+    """
+    try:
+        # Extrair dados necessários
+        appeal_text = data.get('appeal_text', '')
+        draft_response = data.get('draft_response', '')
+        likely_decision = data.get('likely_decision', '')
+        decision_stats = data.get('decision_stats', {})
+        generation_metadata = data.get('generation_metadata', {})
+        similar_appeals_count = data.get('similar_appeals_count', 0)
+        
+        if not draft_response:
+            raise HTTPException(status_code=400, detail="Minuta não disponível para download")
+        
+        # Renderiza o template compilado
+        now = datetime.now()
+        content = _minuta_tpl.render(
+            now=now,
+            appeal_text=appeal_text,
+            draft_response=draft_response,
+            likely_decision=likely_decision,
+            decision_stats=decision_stats,
+            generation_metadata=generation_metadata,
+            similar_appeals_count=similar_appeals_count,
+        )
         
         # Nome do arquivo com data/hora
         filename = f"Minuta_CGU_LAI_{now.strftime('%d-%m-%Y_%H-%M')}.txt"
         
-        # Retornar como resposta de download
+        # Retornar como resposta de download (cabeçalho já em bytes)
         return Response(
-            content=content.encode('utf-8'),
+            content=_MINUTA_HEADER + content.encode('utf-8'),
             media_type='text/plain; charset=utf-8',
             headers={
                 'Content-Disposition': f'attachment; filename="{filename}"',
@@ -1,10 +1,34 @@
 # models.py
-from pydantic import BaseModel, Field, validator
-from typing import List, Dict, Union, Optional, Any
+import os
+
+from pydantic import BaseModel, ConfigDict, Field, field_validator, model_validator
+from typing import List, Dict, Optional, Any
+
+# Exemplos do OpenAPI só entram em memória quando explicitamente pedidos
+# (OPENAPI_EXAMPLES=1, ex.: ao gerar a spec); workers de produção atrás de
+# um gateway não carregam esses dicts em cada import
+if os.environ.get("OPENAPI_EXAMPLES"):
+    from app.docs_examples import EXAMPLES as _EXAMPLES
+else:
+    _EXAMPLES = {}
+
+
+def _schema_extra(model_name: str) -> Optional[Dict[str, Any]]:
+    example = _EXAMPLES.get(model_name)
+    return {"example": example} if example is not None else None
 
 
 # Modelo para a requisição de análise de recurso
 class AppealQuery(BaseModel):
+    # extra="ignore" descarta campos desconhecidos sem erro; frozen evita
+    # __dict__ mutável; str_strip_whitespace normaliza no parser em Rust
+    model_config = ConfigDict(
+        defer_build=True,
+        extra="ignore",
+        frozen=True,
+        str_strip_whitespace=True,
+    )
+
     text: str = Field(
         ..., 
         min_length=10, 
@@ -32,16 +56,20 @@ class AppealQuery(BaseModel):
         example=0.7
     )
     
-    @validator('text')
+    # field_validator nativo do v2 (sem o shim de compatibilidade do
+    # @validator); o strip fica por conta do str_strip_whitespace
+    @field_validator('text', mode='before')
+    @classmethod
     def validate_text(cls, v):
-        if not v or v.isspace():
+        if not v or (isinstance(v, str) and v.isspace()):
             raise ValueError('O texto do recurso não pode estar vazio')
-        return v.strip()
-    
-    @validator('instance_filter')
+        return v
+
+    @field_validator('instance_filter', mode='after')
+    @classmethod
     def validate_instance_filter(cls, v):
         if v:
-            return v.strip().upper()
+            return v.upper()
         return v
 
 
@@ -53,28 +81,42 @@ class SimilarAppeal(BaseModel):
     response: str = Field(..., description="Resposta oficial ao recurso")
     decision: str = Field(..., description="Decisão final (Deferido, Indeferido, etc.)")
     instance: str = Field(..., description="Instância que analisou o recurso")
-    
-    class Config:
-        json_schema_extra = {
-            "example": {
-                "id": 12345,
-                "score": 0.85,
-                "description": "Solicito acesso aos contratos...",
-                "response": "No exercício das atribuições...",
-                "decision": "Indeferido",
-                "instance": "CGU"
-            }
-        }
+
+    # revalidate_instances="never": o FastAPI não repete a validação na
+    # serialização da resposta (modelo quente, um por hit de busca)
+    model_config = ConfigDict(
+        defer_build=True,
+        extra="ignore",
+        frozen=True,
+        revalidate_instances="never",
+        json_schema_extra=_schema_extra("SimilarAppeal"),
+    )
+
+
+# Estatística de uma decisão entre os casos similares
+class DecisionStat(BaseModel):
+    # Modelo concreto no lugar de Dict[str, Union[float, int]]: o
+    # pydantic-core gera um validador monomórfico, sem discriminar a
+    # Union valor a valor na (de)serialização
+    model_config = ConfigDict(
+        defer_build=True,
+        extra="ignore",
+        frozen=True,
+        revalidate_instances="never",
+    )
+
+    count: int = Field(..., description="Quantidade de casos com esta decisão")
+    percentage: float = Field(..., description="Percentual sobre o total de casos")
 
 
 # Modelo para o resultado final da análise de recurso (básico)
 class AnalysisResult(BaseModel):
     likely_decision: str = Field(
-        ..., 
+        ...,
         description="Predição da decisão mais provável",
         example="Provavelmente Indeferido"
     )
-    decision_stats: Dict[str, Dict[str, Union[float, int]]] = Field(
+    decision_stats: Dict[str, DecisionStat] = Field(
         ...,
         description="Estatísticas das decisões dos casos similares"
     )
@@ -83,45 +125,40 @@ class AnalysisResult(BaseModel):
         description="Lista de recursos similares encontrados"
     )
     
-    class Config:
-        json_schema_extra = {
-            "example": {
-                "likely_decision": "Provavelmente Indeferido",
-                "decision_stats": {
-                    "Indeferido": {"count": 3, "percentage": 60.0},
-                    "Deferido": {"count": 2, "percentage": 40.0}
-                },
-                "similar_appeals": []
-            }
-        }
+    model_config = ConfigDict(
+        defer_build=True,
+        extra="ignore",
+        frozen=True,
+        json_schema_extra=_schema_extra("AnalysisResult"),
+    )
 
 
 # Modelo para o resultado COM minuta gerada
 class AnalysisResultWithDraft(AnalysisResult):
     draft_response: str = Field(
-        ..., 
-        description="Minuta de resposta gerada automaticamente pela IA",
-        min_length=100
+        ...,
+        description="Minuta de resposta gerada automaticamente pela IA"
     )
     generation_metadata: Optional[Dict[str, Any]] = Field(
-        None, 
+        None,
         description="Metadados sobre a geração da minuta (modelo, tokens, etc.)"
     )
+
+    # Checagem de tamanho só na ingestão: respostas montadas com
+    # model_construct (saída confiável) não pagam a medição da string
+    # multi-KB a cada serialização
+    @model_validator(mode='after')
+    def _check_draft(self):
+        if len(self.draft_response) < 100:
+            raise ValueError('draft_response deve ter ao menos 100 caracteres')
+        return self
     
-    class Config:
-        json_schema_extra = {
-            "example": {
-                "likely_decision": "Provavelmente Indeferido",
-                "decision_stats": {},
-                "similar_appeals": [],
-                "draft_response": "DECISÃO\n\nConsiderando o recurso interposto...",
-                "generation_metadata": {
-                    "model_used": "llama3-70b-8192",
-                    "tokens_used": 1500,
-                    "generation_time": "~2 segundos"
-                }
-            }
-        }
+    model_config = ConfigDict(
+        defer_build=True,
+        extra="ignore",
+        frozen=True,
+        json_schema_extra=_schema_extra("AnalysisResultWithDraft"),
+    )
 
 
 # Modelo para cada pedido similar retornado
@@ -133,17 +170,13 @@ class SimilarRequest(BaseModel):
     details: str = Field(..., description="Detalhamento da solicitação")
     decision: str = Field(..., description="Decisão sobre o pedido")
     
-    class Config:
-        json_schema_extra = {
-            "example": {
-                "id": 54321,
-                "protocol": "25820.123456/2023-11",
-                "score": 0.92,
-                "summary": "Acesso a contratos públicos",
-                "details": "Solicitação de acesso aos contratos...",
-                "decision": "Deferido"
-            }
-        }
+    model_config = ConfigDict(
+        defer_build=True,
+        extra="ignore",
+        frozen=True,
+        revalidate_instances="never",
+        json_schema_extra=_schema_extra("SimilarRequest"),
+    )
 
 
 # Modelo para o resultado da busca por protocolo (com protocolo original + similares)
@@ -151,17 +184,9 @@ class ProtocolSearchResult(BaseModel):
     original_request: SimilarRequest = Field(..., description="Pedido original buscado")
     similar_requests: List[SimilarRequest] = Field(..., description="Pedidos similares encontrados")
     
-    class Config:
-        json_schema_extra = {
-            "example": {
-                "original_request": {
-                    "id": 12345,
-                    "protocol": "60110003084201855",
-                    "score": 1.0,
-                    "summary": "Solicitação de contratos",
-                    "details": "Prezados, venho solicitar...",
-                    "decision": "Acesso Concedido"
-                },
-                "similar_requests": []
-            }
-        }
\ No newline at end of file
+    model_config = ConfigDict(
+        defer_build=True,
+        extra="ignore",
+        frozen=True,
+        json_schema_extra=_schema_extra("ProtocolSearchResult"),
+    )
\ No newline at end of file
@@ -1,25 +1,96 @@
 # services.py
-from typing import List, Dict, Optional, Any
-from app.models import SimilarAppeal
+from collections import Counter
+from typing import List, Dict, NamedTuple, Optional, Any
+
+import numpy as np
+
+# Categorias de decisão conhecidas da LAI, mapeadas para códigos pequenos:
+# contagem via np.bincount dispensa o hashing de strings no caminho quente;
+# categorias fora da tabela caem no caminho com Counter
+_DECISION_NAMES = [
+    "Deferido", "Indeferido", "Parcialmente deferido",
+    "Não conhecimento", "Perda de objeto", "Acolhimento", "N/A",
+]
+_DECISION_IDX = {name: i for i, name in enumerate(_DECISION_NAMES)}
+
+def _count_decisions(search_results: List) -> Dict[str, int]:
+    """Conta as decisões dos resultados via bincount sobre códigos inteiros."""
+    decisions = [result.payload.get("decision", "N/A") for result in search_results]
+    try:
+        codes = np.fromiter((_DECISION_IDX[d] for d in decisions),
+                            dtype=np.int8, count=len(decisions))
+    except KeyError:
+        # Categoria fora da tabela: caminho genérico com hashing de strings
+        return Counter(decisions)
+    counts = np.bincount(codes, minlength=len(_DECISION_NAMES))
+    return {_DECISION_NAMES[i]: int(c) for i, c in enumerate(counts) if c}
+
 
 def analyze_decision_stats(search_results: List) -> Dict:
     """Calcula as estatísticas de decisão (Deferido/Indeferido) dos resultados."""
     if not search_results:
         return {}
 
-    decision_counts = {}
-    for result in search_results:
-        decision = result.payload.get("decision", "N/A")
-        decision_counts[decision] = decision_counts.get(decision, 0) + 1
+    # O inverso pré-calculado troca uma divisão por decisão por uma
+    # única multiplicação
+    decision_counts = _count_decisions(search_results)
 
-    total_found = len(search_results)
+    inv = 100.0 / len(search_results)
     stats = {
-        key: {"count": value, "percentage": round((value / total_found) * 100, 2)}
+        key: {"count": value, "percentage": round(value * inv, 2)}
         for key, value in decision_counts.items()
     }
     return stats
 
 
+class StatsBundle(NamedTuple):
+    """Estatísticas, predição e sumário calculados numa única passada."""
+    stats: Dict
+    likely: str
+    summary: Optional[Dict[str, Any]]
+
+
+def summarize(search_results: List) -> StatsBundle:
+    """
+    Funde analyze_decision_stats + determine_likely_decision +
+    get_decision_summary numa travessia única: uma contagem, um dict de
+    stats e os dois argmax saem do mesmo loop, em vez de três passadas
+    separadas sobre os mesmos dados. As funções individuais continuam
+    disponíveis para quem precisa de um campo só.
+    """
+    if not search_results:
+        return StatsBundle({}, "Indeterminado", None)
+
+    decision_counts = _count_decisions(search_results)
+
+    total = len(search_results)
+    inv = 100.0 / total
+    stats = {}
+    most_common = None
+    most_common_count = -1
+    likely = None
+    likely_count = -1
+    for key, value in decision_counts.items():
+        stats[key] = {"count": value, "percentage": round(value * inv, 2)}
+        if value > most_common_count:
+            most_common, most_common_count = key, value
+        if value > likely_count and key in ("Deferido", "Indeferido"):
+            likely, likely_count = key, value
+
+    if likely is None:
+        likely_str = "Indeterminado (nenhum Deferido/Indeferido encontrado nos similares)"
+    else:
+        likely_str = f"Provavelmente {likely}"
+
+    summary = {
+        "total_cases": total,
+        "decision_types": len(stats),
+        "most_common": most_common,
+        "distribution": {k: v["percentage"] for k, v in stats.items()},
+    }
+    return StatsBundle(stats, likely_str, summary)
+
+
 def determine_likely_decision(stats: Dict) -> str:
     """Determina a decisão mais provável com base nas estatísticas."""
     if not stats:
@@ -33,22 +104,32 @@ def determine_likely_decision(stats: Dict) -> str:
     return f"Provavelmente {most_common}"
 
 
-def format_similar_appeals(search_results: List) -> List[SimilarAppeal]:
-    """Formata os resultados da busca do Qdrant no modelo Pydantic."""
+# Campos do payload e seus defaults, pareados por posição: o zip no loop
+# dispensa quatro lookups de atributo/método por hit e mantém o par
+# campo/default definido num lugar só
+_FIELDS = ("description", "response", "decision", "instance")
+_DEFAULTS = ("", "", "N/A", "N/A")
+
+
+def format_similar_appeals_raw(search_results: List) -> List[Dict]:
+    """Formata os resultados da busca do Qdrant em dicts puros.
+
+    Evita materializar modelos Pydantic no meio do fluxo: quem precisa do
+    modelo constrói na borda da resposta, e quem precisa de dicts (ex.: o
+    gerador de minutas) usa direto, sem o round-trip model -> .dict().
+    """
     appeals_list = []
     for result in search_results:
-        payload = result.payload
-        appeals_list.append(
-            SimilarAppeal(
-                id=result.id, score=result.score,
-                description=payload.get("description", ""),
-                response=payload.get("response", ""),
-                decision=payload.get("decision", "N/A"),
-                instance=payload.get("instance", "N/A")
-            )
-        )
+        p = result.payload
+        desc, resp, dec, inst = (p.get(f, d) for f, d in zip(_FIELDS, _DEFAULTS))
+        appeals_list.append({
+            "id": result.id, "score": result.score,
+            "description": desc, "response": resp,
+            "decision": dec, "instance": inst,
+        })
     return appeals_list
 
+
 def get_decision_summary(stats: Dict) -> Optional[Dict[str, Any]]:
     """Gera um sumário das decisões para debugging e monitoramento."""
     if not stats:
@@ -1,11 +1,18 @@
 # index_from_docker.py
+import gc
 import os
 import pickle
 import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
 import pandas as pd
+import pyarrow.parquet as pq
 from qdrant_client import QdrantClient, models
 from tqdm import tqdm
 import docker
+import io
+import tarfile
 import tempfile
 import shutil
 
@@ -18,14 +25,70 @@ logger = logging.getLogger(__name__)
 # --- Configurações ---
 CONTAINER_NAME = "mvp-data"
 DOCKER_DATA_PATH = "/data"
+DATA_VOLUME_NAME = os.getenv("DATA_VOLUME_NAME", "mvp_data_volume")
 
 # Configs do Qdrant (com suporte a variáveis de ambiente)
 QDRANT_HOST = os.getenv("QDRANT_HOST", "127.0.0.1")
 QDRANT_PORT = int(os.getenv("QDRANT_PORT", "6333"))
+QDRANT_GRPC_PORT = int(os.getenv("QDRANT_GRPC_PORT", "6334"))
 QDRANT_RECURSOS_COLLECTION_NAME = "recursos_cgu_v1"
 QDRANT_PEDIDOS_COLLECTION_NAME = "pedidos_cgu_v1"
 
 
+class _ArchiveStream(io.RawIOBase):
+    """Adapta o gerador de chunks do get_archive para file-like legível.
+
+    Permite extrair o tar em streaming (mode='r|'), sem materializar o
+    arquivo inteiro em disco antes da extração.
+    """
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._sobra = b""
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        while not self._sobra:
+            try:
+                self._sobra = next(self._chunks)
+            except StopIteration:
+                return 0
+        n = min(len(b), len(self._sobra))
+        b[:n] = self._sobra[:n]
+        self._sobra = self._sobra[n:]
+        return n
+
+
+def get_volume_mountpoint():
+    """Resolve o Mountpoint do volume de dados direto no host.
+
+    Quando o indexador roda na mesma máquina do daemon Docker, ler o
+    volume no seu caminho de montagem dispensa a fase inteira de cópia
+    (get_archive + extração) — inicialização sem mover um byte.
+    """
+    try:
+        client = docker.from_env()
+        volume = client.volumes.get(DATA_VOLUME_NAME)
+        mountpoint = volume.attrs['Mountpoint']
+    except docker.errors.NotFound:
+        logger.warning(f"⚠️ Volume {DATA_VOLUME_NAME} não encontrado")
+        return None
+    except Exception as e:
+        logger.warning(f"⚠️ Erro ao inspecionar volume {DATA_VOLUME_NAME}: {e}")
+        return None
+
+    # Sem permissão de leitura (ex.: daemon remoto ou rootful sem sudo),
+    # cai no caminho antigo de cópia
+    if not os.access(os.path.join(mountpoint, "dt_recursos.parquet"), os.R_OK):
+        logger.warning(f"⚠️ Sem acesso de leitura a {mountpoint}")
+        return None
+
+    logger.info(f"📁 Usando o volume montado diretamente: {mountpoint}")
+    return mountpoint
+
+
 def copy_data_from_container():
     """Copia dados do container Docker para diretório temporário local."""
     logger.info(f"📦 Copiando dados do container {CONTAINER_NAME}")
@@ -43,35 +106,22 @@ def copy_data_from_container():
             logger.error(f"❌ Container {CONTAINER_NAME} não está rodando!")
             return None
             
-        # Copiar dados do container
-        logger.info("📋 Copiando arquivos parquet...")
+        # Copiar dados do container: o tar é extraído em streaming
+        # direto do socket do Docker, sem gravar (e reler) o arquivo
+        # intermediário em disco. Os três streams são independentes e
+        # descem em paralelo (o GIL é solto nas leituras de socket e na
+        # extração), então o passo custa ~max dos três em vez da soma
+        logger.info("📋 Copiando arquivos parquet e vetores...")
         
-        # Copiar dt_recursos.parquet
-        bits, _ = container.get_archive(f"{DOCKER_DATA_PATH}/dt_recursos.parquet")
-        with open(os.path.join(temp_dir, "dt_recursos.tar"), "wb") as f:
-            for chunk in bits:
-                f.write(chunk)
-        
-        # Copiar dt_pedidos.parquet  
-        bits, _ = container.get_archive(f"{DOCKER_DATA_PATH}/dt_pedidos.parquet")
-        with open(os.path.join(temp_dir, "dt_pedidos.tar"), "wb") as f:
-            for chunk in bits:
-                f.write(chunk)
-                
-        # Copiar diretório vetores
-        bits, _ = container.get_archive(f"{DOCKER_DATA_PATH}/vetores")
-        with open(os.path.join(temp_dir, "vetores.tar"), "wb") as f:
-            for chunk in bits:
-                f.write(chunk)
-        
-        # Extrair arquivos tar
-        import tarfile
-        
-        for tar_file in ["dt_recursos.tar", "dt_pedidos.tar", "vetores.tar"]:
-            tar_path = os.path.join(temp_dir, tar_file)
-            with tarfile.open(tar_path, "r") as tar:
+        def buscar_e_extrair(origem: str):
+            bits, _ = container.get_archive(f"{DOCKER_DATA_PATH}/{origem}")
+            with tarfile.open(fileobj=_ArchiveStream(bits), mode="r|",
+                              bufsize=1 << 20) as tar:
                 tar.extractall(temp_dir)
-            os.remove(tar_path)
+
+        with ThreadPoolExecutor(max_workers=3) as executor:
+            list(executor.map(buscar_e_extrair,
+                              ["dt_recursos.parquet", "dt_pedidos.parquet", "vetores"]))
         
         logger.info("✅ Dados copiados com sucesso!")
         return temp_dir
@@ -84,6 +134,19 @@ def copy_data_from_container():
         return None
 
 
+def _pickle_contains_key(path: str, key: bytes, chunk_size: int = 1 << 20) -> bool:
+    """Procura a chave nos bytes crus do pickle, sem desserializá-lo."""
+    sobra = b""
+    with open(path, 'rb') as f:
+        while True:
+            bloco = f.read(chunk_size)
+            if not bloco:
+                return False
+            if key in sobra + bloco:
+                return True
+            sobra = bloco[-(len(key) - 1):]
+
+
 def validate_files(parquet_path: str, pickle_path: str) -> bool:
     """Valida se os arquivos existem e são válidos."""
     if not os.path.exists(parquet_path):
@@ -95,16 +158,16 @@ def validate_files(parquet_path: str, pickle_path: str) -> bool:
         return False
         
     try:
-        # Testa leitura dos arquivos
-        df_test = pd.read_parquet(parquet_path)
-        logger.info(f"Arquivo Parquet válido: {len(df_test)} registros")
+        # Só o footer do Parquet (metadados) e os bytes crus do pickle:
+        # a leitura completa dos dois arquivos fica para a carga em si,
+        # sem pagar o parse duas vezes
+        num_rows = pq.ParquetFile(parquet_path).metadata.num_rows
+        logger.info(f"Arquivo Parquet válido: {num_rows} registros")
         
-        with open(pickle_path, 'rb') as f:
-            data = pickle.load(f)
-            if 'embeddings' not in data:
-                logger.error("Arquivo pickle não contém chave 'embeddings'")
-                return False
-            logger.info(f"Arquivo Pickle válido: {len(data['embeddings'])} embeddings")
+        if not _pickle_contains_key(pickle_path, b'embeddings'):
+            logger.error("Arquivo pickle não contém chave 'embeddings'")
+            return False
+        logger.info("Arquivo Pickle contém a chave 'embeddings'")
         
         return True
         
@@ -113,32 +176,53 @@ def validate_files(parquet_path: str, pickle_path: str) -> bool:
         return False
 
 
+def _ensure_npy_cache(pickle_path: str) -> str:
+    """Converte o pickle de embeddings para um cache .npy float32 (uma vez).
+
+    Ao contrário do pickle, o .npy abre com mmap_mode='r': o kernel pagina
+    o buffer sob demanda conforme o upload drena os lotes, em vez de
+    desserializar a matriz inteira em RAM na partida.
+    """
+    npy_path = os.path.splitext(pickle_path)[0] + ".npy"
+    if (not os.path.exists(npy_path)
+            or os.path.getmtime(npy_path) < os.path.getmtime(pickle_path)):
+        logger.info(f"Gerando cache mapeável {npy_path}")
+        with open(pickle_path, 'rb', buffering=1 << 20) as f:
+            data = pickle.load(f)
+        arr = np.asarray(data['embeddings'], dtype=np.float32)
+        del data
+        gc.collect()
+        np.save(npy_path, arr)
+    return npy_path
+
+
 def load_data_and_vectors(parquet_path: str, pickle_path: str):
-    """Carrega dados do parquet e vetores do pickle."""
+    """Carrega dados do parquet e vetores memory-mapped do cache .npy."""
     logger.info(f"Carregando metadados de {parquet_path}")
     df = pd.read_parquet(parquet_path)
     logger.info(f"Carregados {len(df)} registros do Parquet")
     
     logger.info(f"Carregando vetores pré-calculados de {pickle_path}")
-    with open(pickle_path, 'rb') as f:
-        data = pickle.load(f)
-    
-    embeddings = data['embeddings']
+    try:
+        embeddings = np.load(_ensure_npy_cache(pickle_path), mmap_mode='r')
+    except OSError as e:
+        # Diretório somente leitura ou sem espaço: carrega o pickle em RAM
+        logger.warning(f"⚠️ Sem cache .npy ({e}); carregando o pickle inteiro")
+        with open(pickle_path, 'rb', buffering=1 << 20) as f:
+            data = pickle.load(f)
+        embeddings = np.ascontiguousarray(data['embeddings'], dtype=np.float32)
+        # Sem o dict do pickle vivo, o pico de RSS fica só com a matriz
+        del data
+        gc.collect()
     logger.info(f"Carregados {len(embeddings)} vetores")
     
-    # Atribuir vetores ao DataFrame
-    logger.info("Atribuindo vetores ao DataFrame")
-    # Converter array 2D para lista de arrays 1D
-    if len(embeddings.shape) == 2:
-        df['embedding'] = [embeddings[i] for i in range(min(len(df), len(embeddings)))]
-    else:
-        df['embedding'] = embeddings[:len(df)]
-    
-    # Filtrar apenas registros com embeddings válidos
-    df = df.dropna(subset=['embedding'])
-    logger.info(f"Total de {len(df)} registros prontos para indexação")
+    # Alinhar metadados e vetores pelo menor comprimento
+    n = min(len(df), len(embeddings))
+    df = df.iloc[:n]
+    embeddings = embeddings[:n]
+    logger.info(f"Total de {n} registros prontos para indexação")
     
-    return df
+    return df, embeddings
 
 
 def create_collection(client: QdrantClient, collection_name: str, vector_size: int = 768):
@@ -149,12 +233,26 @@ def create_collection(client: QdrantClient, collection_name: str, vector_size: i
             client.delete_collection(collection_name)
         
         logger.info(f"Criando coleção '{collection_name}' com vetores de dimensão {vector_size}")
+        # Indexação HNSW desligada já na criação (m=0, threshold=0): o
+        # servidor só acumula pontos durante a carga e o batch_upsert
+        # religa o índice ao final
         client.create_collection(
             collection_name=collection_name,
             vectors_config=models.VectorParams(
                 size=vector_size,
                 distance=models.Distance.COSINE
-            )
+            ),
+            optimizers_config=models.OptimizersConfigDiff(indexing_threshold=0),
+            hnsw_config=models.HnswConfigDiff(m=0),
+            # Quantização escalar int8 no servidor: 4x menos RAM por vetor
+            # e busca mais rápida, mantendo o float32 original em disco
+            quantization_config=models.ScalarQuantization(
+                scalar=models.ScalarQuantizationConfig(
+                    type=models.ScalarType.INT8,
+                    quantile=0.99,
+                    always_ram=True,
+                )
+            ),
         )
         
     except Exception as e:
@@ -162,94 +260,45 @@ def create_collection(client: QdrantClient, collection_name: str, vector_size: i
         raise
 
 
-def batch_upsert(client: QdrantClient, collection_name: str, df: pd.DataFrame, batch_size: int = 500):
-    """Insere dados em lotes no Qdrant com otimizações."""
+def batch_upsert(client: QdrantClient, collection_name: str, df: pd.DataFrame,
+                 vectors: np.ndarray, batch_size: int = 1024):
+    """Insere dados em massa no Qdrant via upload_collection."""
     total_records = len(df)
-    logger.info(f"Inserindo {total_records} registros em lotes de {batch_size}")
-    
-    # Processar em chunks maiores para reduzir overhead
-    chunk_size = 10000
-    total_chunks = (total_records + chunk_size - 1) // chunk_size
-    
-    processed = 0
-    
-    for chunk_idx in range(total_chunks):
-        start_idx = chunk_idx * chunk_size
-        end_idx = min((chunk_idx + 1) * chunk_size, total_records)
-        
-        chunk_df = df.iloc[start_idx:end_idx]
-        logger.info(f"📦 Processando chunk {chunk_idx + 1}/{total_chunks} ({len(chunk_df)} registros)")
-        
-        # Preparar pontos para este chunk
-        points = []
-        
-        for idx, row in chunk_df.iterrows():
-            # Preparar payload (metadados) - mais eficiente
-            payload = {}
-            for col in chunk_df.columns:
-                if col != 'embedding':
-                    value = row[col]
-                    # Converter valores NaN para None
-                    if pd.isna(value):
-                        payload[col] = None
-                    else:
-                        payload[col] = value
-            
-            # Criar ponto
-            point = models.PointStruct(
-                id=int(idx),
-                vector=row['embedding'].tolist(),
-                payload=payload
-            )
-            points.append(point)
-            
-            # Inserir em lotes menores
-            if len(points) >= batch_size:
-                try:
-                    client.upsert(
-                        collection_name=collection_name,
-                        points=points,
-                        wait=False  # Não esperar confirmação para ser mais rápido
-                    )
-                    processed += len(points)
-                    points = []
-                except Exception as e:
-                    logger.warning(f"⚠️ Erro no batch, tentando novamente: {e}")
-                    # Tentar com batch menor se der erro
-                    for point in points:
-                        try:
-                            client.upsert(collection_name=collection_name, points=[point], wait=False)
-                            processed += 1
-                        except Exception as e2:
-                            logger.error(f"❌ Erro no ponto individual: {e2}")
-                    points = []
-        
-        # Inserir últimos pontos do chunk
-        if points:
-            try:
-                client.upsert(
-                    collection_name=collection_name,
-                    points=points,
-                    wait=False
-                )
-                processed += len(points)
-            except Exception as e:
-                logger.warning(f"⚠️ Erro no último batch: {e}")
-                for point in points:
-                    try:
-                        client.upsert(collection_name=collection_name, points=[point], wait=False)
-                        processed += 1
-                    except Exception as e2:
-                        logger.error(f"❌ Erro no ponto individual: {e2}")
-        
-        logger.info(f"✅ Chunk {chunk_idx + 1} processado. Total: {processed}/{total_records}")
-    
-    # Aguardar finalização da indexação
-    logger.info("⏳ Aguardando finalização da indexação...")
-    import time
-    time.sleep(10)  # Dar tempo para o Qdrant processar
-    
-    logger.info(f"✅ {processed} pontos inseridos na coleção '{collection_name}'")
+    logger.info(f"Inserindo {total_records} registros (batch_size={batch_size})")
+
+    # A coleção nasce com a indexação desligada (create_collection); o
+    # finally abaixo religa o HNSW depois que todos os pontos chegaram
+    try:
+        # Preparação vetorizada (sem Series por linha) + upload paralelo:
+        # upload_collection aceita o ndarray direto e fatia sem converter
+        # float a float para listas Python
+        payloads = df.astype(object).where(df.notna(), None).to_dict(orient='records')
+        ids = df.index.astype('int64').tolist()
+
+        client.upload_collection(
+            collection_name=collection_name,
+            vectors=vectors,
+            payload=payloads,
+            ids=ids,
+            batch_size=batch_size,
+            parallel=max(4, (os.cpu_count() or 4) // 2),
+        )
+    finally:
+        # Religa a indexação com os parâmetros padrão e espera o índice
+        client.update_collection(
+            collection_name=collection_name,
+            optimizer_config=models.OptimizersConfigDiff(indexing_threshold=20000),
+            hnsw_config=models.HnswConfigDiff(m=16),
+        )
+        for _ in range(150):
+            info = client.get_collection(collection_name=collection_name)
+            if info.status == models.CollectionStatus.GREEN:
+                break
+            time.sleep(2)
+        else:
+            logger.warning("Coleção ainda otimizando após a espera; seguindo")
+
+    logger.info(f"✅ {total_records} pontos enviados para a coleção '{collection_name}'")
 
 
 def index_collection(client: QdrantClient, collection_name: str, parquet_path: str, pickle_path: str):
@@ -263,7 +312,7 @@ def index_collection(client: QdrantClient, collection_name: str, parquet_path: s
     
     # Carregar dados
     try:
-        df = load_data_and_vectors(parquet_path, pickle_path)
+        df, vectors = load_data_and_vectors(parquet_path, pickle_path)
     except Exception as e:
         logger.error(f"Erro ao carregar dados: {e}")
         return False
@@ -277,7 +326,7 @@ def index_collection(client: QdrantClient, collection_name: str, parquet_path: s
     
     # Inserir dados
     try:
-        batch_upsert(client, collection_name, df)
+        batch_upsert(client, collection_name, df, vectors)
         return True
     except Exception as e:
         logger.error(f"Erro ao inserir dados: {e}")
@@ -288,24 +337,31 @@ def main():
     """Função principal."""
     logger.info("🚀 Iniciando processo de indexação a partir do container Docker")
     
-    # Copiar dados do container
-    temp_dir = copy_data_from_container()
-    if not temp_dir:
+    # Ler o volume direto do host quando possível; só copiar do container
+    # como fallback
+    data_dir = get_volume_mountpoint()
+    temp_dir = None
+    if not data_dir:
+        temp_dir = copy_data_from_container()
+        data_dir = temp_dir
+    if not data_dir:
         logger.error("❌ Falha ao copiar dados do container")
         return
     
     try:
         # Conectar ao Qdrant
-        client = QdrantClient(host=QDRANT_HOST, port=QDRANT_PORT)
+        # gRPC corta o overhead de (de)serializacao JSON no caminho de carga
+        client = QdrantClient(host=QDRANT_HOST, port=QDRANT_PORT,
+                              grpc_port=QDRANT_GRPC_PORT, prefer_grpc=True)
         logger.info(f"Conectado ao Qdrant em {QDRANT_HOST}:{QDRANT_PORT}")
         
         # Definir caminhos dos arquivos
-        recursos_parquet = os.path.join(temp_dir, "dt_recursos.parquet")
-        pedidos_parquet = os.path.join(temp_dir, "dt_pedidos.parquet")
+        recursos_parquet = os.path.join(data_dir, "dt_recursos.parquet")
+        pedidos_parquet = os.path.join(data_dir, "dt_pedidos.parquet")
         
         nome_base_arquivo = "intfloat_multilingual-e5-base_ft_False"
-        recursos_pickle = os.path.join(temp_dir, "vetores", f"{nome_base_arquivo}_vetores_recursos_2015_2023.pkl")
-        pedidos_pickle = os.path.join(temp_dir, "vetores", f"{nome_base_arquivo}_vetores_pedidos_2015_2023.pkl")
+        recursos_pickle = os.path.join(data_dir, "vetores", f"{nome_base_arquivo}_vetores_recursos_2015_2023.pkl")
+        pedidos_pickle = os.path.join(data_dir, "vetores", f"{nome_base_arquivo}_vetores_pedidos_2015_2023.pkl")
         
         # Indexar recursos
         logger.info("=== INDEXANDO RECURSOS ===")
@@ -342,9 +398,10 @@ def main():
             logger.error("❌ Processo de indexação concluído com erros")
             
     finally:
-        # Limpar diretório temporário
-        logger.info(f"🧹 Limpando diretório temporário: {temp_dir}")
-        shutil.rmtree(temp_dir, ignore_errors=True)
+        # Limpar diretório temporário (só existe no caminho de cópia)
+        if temp_dir:
+            logger.info(f"🧹 Limpando diretório temporário: {temp_dir}")
+            shutil.rmtree(temp_dir, ignore_errors=True)
 
 
 if __name__ == "__main__":